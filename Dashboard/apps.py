@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class DashboardConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Dashboard'
+
+    def ready(self):
+        from . import signals
+        from . import exports, importers, snapshots  # register the export, import and snapshot job handlers
+        from .search import create_search_indexes
+        post_migrate.connect(create_search_indexes, sender=self)
@@ -0,0 +1,132 @@
+import hashlib
+from functools import partial
+from functools import wraps
+from urllib.parse import urlencode
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpResponse
+from .models import CacheVersion
+
+# Namespace whose version changes whenever product-facing catalog data changes
+CATALOG = 'catalog'
+# Namespace for customer lists and lock state used by the Android app
+CUSTOMERS = 'customers'
+# Namespace for carts and their items
+CARTS = 'carts'
+
+
+def get_versions(*namespaces):
+    """
+    Current version tokens of the given namespaces, in order. The counters live in the
+    database rather than the cache: a per-process cache would give every worker its own.
+    """
+    versions = dict(CacheVersion.objects.filter(namespace__in=namespaces).values_list('namespace', 'version'))
+    for namespace in namespaces:
+        if namespace not in versions:
+            versions[namespace] = CacheVersion.objects.get_or_create(namespace=namespace)[0].version
+    return [str(versions[namespace]) for namespace in namespaces]
+
+
+def get_version(namespace):
+    """Current version token for a namespace, shared by every worker through the database"""
+    return get_versions(namespace)[0]
+
+
+def _increment(namespace):
+    if not CacheVersion.objects.filter(namespace=namespace).update(version=F('version') + 1):
+        CacheVersion.objects.get_or_create(namespace=namespace)
+
+
+def _bump_pending(connection, namespace):
+    # A bump registered at this savepoint level or outside it commits or rolls back with ours
+    savepoint_ids = set(connection.savepoint_ids)
+    return any(
+        isinstance(func, partial) and func.func is _increment and func.args == (namespace,)
+        and sids <= savepoint_ids
+        for sids, func, *_ in connection.run_on_commit
+    )
+
+
+def bump_version(namespace):
+    """
+    Invalidate everything derived from a namespace once the current transaction commits.
+    Bumps are coalesced to one per namespace per transaction, however many rows it writes.
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and _bump_pending(connection, namespace):
+        return
+    transaction.on_commit(partial(_increment, namespace))
+
+
+def make_key(namespace, *parts, version=None):
+    """
+    Cache key scoped to the current version of `namespace` (or `version`, when the caller
+    already read it); bumping the namespace orphans every key made before it. Long parts
+    are hashed to stay within key limits.
+    """
+    raw = ':'.join(str(part) for part in parts)
+    if len(raw) > 100:
+        raw = hashlib.md5(raw.encode()).hexdigest()
+    if version is None:
+        version = get_version(namespace)
+    return f'{namespace}:{version}:{raw}'
+
+
+def get_catalog_version():
+    return get_version(CATALOG)
+
+
+def bump_catalog_version():
+    bump_version(CATALOG)
+
+
+def versioned_cache_page(namespace=CATALOG, timeout=None):
+    """
+    Cache successful GET responses under the normalized query string and the current
+    version of `namespace`. Any write that bumps the version makes every stored page
+    unreachable, so entries can be kept long without ever being served stale.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 60 * 60)
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view_func(request, *args, **kwargs)
+
+            # Absolute URLs in payloads depend on scheme and host
+            query = urlencode(sorted((k, v) for k in request.GET for v in request.GET.getlist(k)))
+            key = make_key(
+                namespace, 'response', f'{view_func.__module__}.{view_func.__name__}',
+                f'{request.scheme}://{request.get_host()}', args, kwargs, query
+            )
+
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+
+            response = view_func(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, (response.content, response['Content-Type']), timeout)
+            return response
+        return wrapper
+    return decorator
+
+
+def versioned_etag(*namespaces):
+    """
+    etag_func for django.views.decorators.http.condition(): a strong validator that
+    changes whenever the request URL or any of the namespace versions does, computed
+    from a single version lookup so a 304 costs no further database work. The versions
+    are left on request.cache_versions for the view to reuse instead of reading them again.
+    """
+    def etag_func(request, *args, **kwargs):
+        parts = get_versions(*namespaces)
+        request.cache_versions = dict(zip(namespaces, parts))
+        parts += [request.get_host(), request.get_full_path(), args, sorted(kwargs.items())]
+        return hashlib.md5(repr(parts).encode()).hexdigest()
+    return etag_func
@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.urls import reverse
+from .caching import CATALOG, get_catalog_version, make_key
+from .models import Product
+
+MATCHING_ITEMS_PER_SET = 5
+
+
+def find_product(field, value):
+    """Resolve a scanned code the same way single_product always has"""
+    products = Product.objects.select_related('tag').prefetch_related('pairing_set', 'images')
+    if field == 'code':
+        return products.filter(Q(child_code=value) | Q(parent_code=value)).first()
+    return products.filter(**{field: value}).first()
+
+
+def _load_matching_items(product_id, pairing_ids, limit):
+    """
+    Top `limit` neighbours per pairing set with their primary image, in two queries
+    no matter how many sets the product belongs to.
+    """
+    through = Product.pairing_set.through
+    neighbours = (
+        through.objects.filter(pairingset_id__in=pairing_ids)
+        .exclude(product_id=product_id)
+        .annotate(rank=Window(RowNumber(), partition_by=[F('pairingset_id')], order_by=F('product_id').asc()))
+        .filter(rank__lte=limit)
+        .values_list('pairingset_id', 'product_id')
+    )
+    by_set = {}
+    for pairing_id, neighbour_id in neighbours:
+        by_set.setdefault(pairing_id, []).append(neighbour_id)
+
+    neighbour_ids = {pid for ids in by_set.values() for pid in ids}
+    products = Product.objects.filter(id__in=neighbour_ids).select_related('primary_image').in_bulk()
+
+    matching_items = []
+    for pairing_id in pairing_ids:
+        for neighbour_id in sorted(by_set.get(pairing_id, [])):
+            matching_prod = products[neighbour_id]
+            matching_items.append({
+                'code': matching_prod.child_code,
+                'parent_code': matching_prod.parent_code,
+                'image_url': matching_prod.primary_image.image.url if matching_prod.primary_image else None
+            })
+    return matching_items
+
+
+def get_matching_items(product_id, pairing_ids, limit=MATCHING_ITEMS_PER_SET, version=None):
+    """
+    Matching items (products sharing a pairing set) for a product, served from a
+    neighbour map cached per product id. The key carries the catalog version, which
+    pairing_set membership changes bump, so entries never outlive the data.
+    """
+    if not pairing_ids:
+        return []
+    key = make_key(CATALOG, 'pairing_neighbours', product_id, limit, version=version)
+    matching_items = cache.get(key)
+    if matching_items is None:
+        matching_items = _load_matching_items(product_id, pairing_ids, limit)
+        cache.set(key, matching_items, getattr(settings, 'PAIRING_NEIGHBOURS_CACHE_TIMEOUT', 60 * 60))
+    return matching_items
+
+
+def build_product_payload(prod, version=None):
+    """
+    single_product response body for a product. Media URLs are left relative so the
+    payload can be shared between hosts; the view makes them absolute.
+    """
+    matching_items = get_matching_items(prod.id, [pairing.id for pairing in prod.pairing_set.all()], version=version)
+
+    return {
+        'success': True,
+        'id': prod.id,
+        'parent_code': prod.parent_code,
+        'child_code': prod.child_code,
+        'location': prod.location,
+        'stock': prod.stock,
+        'kpo': prod.kpo,
+        'pairing_set': [{'value': pairing.pair_value} for pairing in prod.pairing_set.all()],
+        'weight': str(prod.weight),
+        'thai_baht': prod.thai_baht,
+        'usd_rate': prod.usd_rate,
+        'euro_rate': prod.euro_rate,
+        'note_1': prod.note_1,
+        'note_2': prod.note_2,
+        'description': prod.description,
+        'unit': prod.unit,
+        'tag': prod.tag.name if prod.tag else '',
+        'images': [{'url': image.image.url} for image in prod.images.all()],
+        'qrcode_image': reverse('label_image', args=[prod.id, 'qrcode']) if prod.child_code else None,
+        'barcode_image': reverse('label_image', args=[prod.id, 'barcode']) if prod.child_code else None,
+        'matching_items': matching_items,
+        'created_at': prod.created_at.isoformat() if prod.created_at else None,
+        'updated_at': prod.updated_at.isoformat() if prod.updated_at else None,
+    }
+
+
+class CodeIndex:
+    """
+    Per-process map from a scanned code to its prebuilt single_product payload.
+    Entries are filled lazily on first lookup and the whole map is dropped as soon
+    as the shared catalog version moves, so every worker stays in step with writes
+    made by any other worker.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def lookup(self, field, value, version=None):
+        """Return the payload for a code (None if no product matches) as of the given catalog version"""
+        if version is None:
+            version = get_catalog_version()
+        key = (field, value)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        prod = find_product(field, value)
+        payload = build_product_payload(prod, version) if prod else None
+
+        with self._lock:
+            # Skip storing if the catalog moved on while the payload was being built
+            if self._version == version:
+                self._entries[key] = payload
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return payload
+
+
+code_index = CodeIndex(max_entries=getattr(settings, 'CODE_INDEX_MAX_ENTRIES', 50000))
@@ -0,0 +1,82 @@
+import os
+import re
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def _read_range(f, start, length):
+    with f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _byte_range(header, size):
+    """(start, end) for a single 'bytes=' range, None to serve the whole file, or False if unsatisfiable"""
+    match = RANGE_RE.match(header.strip())
+    if not match or not any(match.groups()):
+        # Malformed and multi-range requests get the full body
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def file_download(request, path, content_type, etag, filename=None):
+    """
+    Serve a file on disk with a strong ETag, answering If-None-Match with 304 and
+    single-range requests (optionally guarded by If-Range) with 206. The file is opened
+    before anything else, so a missing file raises FileNotFoundError here, and one
+    removed afterwards is still served whole from the open handle. Conditional and
+    range headers are only honoured on GET and HEAD.
+    """
+    f = open(path, 'rb')
+    size = os.fstat(f.fileno()).st_size
+    etag = quote_etag(etag)
+    conditional = request.method in ('GET', 'HEAD')
+
+    if_none_match = conditional and request.headers.get('If-None-Match')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        f.close()
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    range_header = conditional and request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = _byte_range(range_header, size)
+
+    if byte_range is False:
+        f.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(f, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(f, content_type=content_type)
+
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,325 @@
+import csv
+import glob
+import hashlib
+import io
+import json
+import os
+import tempfile
+import xlsxwriter
+from django.conf import settings
+from django.db.models import Aggregate, CharField, OuterRef, Subquery
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import quote_etag
+from .caching import get_catalog_version
+from .downloads import file_download
+from .jobs import enqueue, job_handler
+from .models import BackgroundJob, CartItem, PairingSet, Product
+
+try:
+    import pyarrow
+    from pyarrow import parquet
+except ImportError:
+    # pyarrow is in requirements.txt; an install without it still serves xlsx and csv
+    pyarrow = parquet = None
+
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+EXPORT_CACHE_DIR = getattr(settings, 'EXPORT_CACHE_DIR', os.path.join(settings.BASE_DIR, 'export_cache'))
+# Files kept per export kind and format; older catalog versions are removed as new ones are built
+EXPORT_CACHE_KEEP = getattr(settings, 'EXPORT_CACHE_KEEP', 2)
+
+PRODUCT_EXPORT_COLUMNS = [
+    'Parent Code', 'Child Code', 'Location', 'QTY', 'kpo', 'pairing_set', 'weight', 'thai_baht', 'usd_rate',
+    'euro_rate', 'Category', 'Unit', 'Product Description', 'Note 1', 'Note 2', 'Image Count',
+]
+PAIRING_SET_EXPORT_COLUMNS = ['ID', 'Pair Value']
+
+
+class GroupConcat(Aggregate):
+    """Values joined with ', ': STRING_AGG on PostgreSQL, GROUP_CONCAT on SQLite and MySQL"""
+    function = 'GROUP_CONCAT'
+    template = "%(function)s(%(expressions)s, ', ')"
+    output_field = CharField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='STRING_AGG', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="%(function)s(%(expressions)s SEPARATOR ', ')", **extra_context)
+
+
+def pairing_values(product_ref='pk'):
+    """Subquery of a product's pairing set values joined with ', ' (None without any), for annotate()"""
+    through = Product.pairing_set.through
+    return Subquery(
+        through.objects.filter(product_id=OuterRef(product_ref)).order_by()
+        .values('product_id').annotate(values=GroupConcat('pairingset__pair_value')).values('values')
+    )
+
+
+def export_products(queryset):
+    """Products with every export column loaded by one query, so rows need no further lookups"""
+    return queryset.select_related('tag').annotate(pairing_values=pairing_values())
+
+
+def export_cart_items(cart):
+    """Cart items with their product, tag, primary image and pairing set values loaded by one query"""
+    return CartItem.objects.filter(cart=cart).select_related('product__tag', 'product__primary_image').annotate(
+        pairing_values=pairing_values('product_id'),
+    )
+
+
+def product_export_row(prod):
+    """Export columns of a product from export_products()"""
+    return [
+        prod.parent_code,
+        prod.child_code,
+        prod.location,
+        prod.stock,
+        prod.kpo,
+        prod.pairing_values,
+        prod.weight,
+        prod.thai_baht,
+        prod.usd_rate,
+        prod.euro_rate,
+        (prod.tag.name if getattr(prod, 'tag', None) else ''),
+        (prod.unit or ''),
+        (prod.description or ''),
+        prod.note_1,
+        prod.note_2,
+        prod.image_count,
+    ]
+
+
+def write_xlsx(file, sheet_title, columns, rows):
+    """
+    Write a header and rows to an .xlsx file with XlsxWriter's constant_memory mode,
+    which flushes each row to disk as soon as the next one starts, so memory use does
+    not grow with the number of rows. Rows must be written in order.
+    """
+    workbook = xlsxwriter.Workbook(file, {'constant_memory': True, 'strings_to_urls': False})
+    worksheet = workbook.add_worksheet(sheet_title)
+    worksheet.write_row(0, 0, columns)
+    for row_index, row in enumerate(rows, 1):
+        worksheet.write_row(row_index, 0, row)
+    workbook.close()
+
+
+def xlsx_response(filename, sheet_title, columns, rows):
+    """Build the workbook in an anonymous temp file and stream it back; the file goes away once sent"""
+    tmp = tempfile.TemporaryFile()
+    try:
+        write_xlsx(tmp, sheet_title, columns, rows)
+        tmp.seek(0)
+    except BaseException:
+        tmp.close()
+        raise
+    return FileResponse(tmp, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
+
+
+def csv_chunks(columns, rows, chunk_rows=500):
+    """UTF-8 encoded CSV, header first, a few hundred rows per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def write_csv(file, columns, rows):
+    for chunk in csv_chunks(columns, rows):
+        file.write(chunk)
+
+
+_PARQUET_CONVERTERS = {'string': str, 'float64': float, 'int64': int}
+
+
+def write_parquet(file, columns, rows, types):
+    """
+    Write rows as a Parquet file one row group per EXPORT_CHUNK_SIZE rows, so memory
+    use stays flat. types maps column names to pyarrow type names; the rest are strings.
+    """
+    schema = pyarrow.schema([(column, getattr(pyarrow, types.get(column, 'string'))()) for column in columns])
+    converters = [_PARQUET_CONVERTERS.get(types.get(column, 'string'), str) for column in columns]
+    with parquet.ParquetWriter(file, schema) as writer:
+        for batch in _batches(rows, EXPORT_CHUNK_SIZE):
+            arrays = [
+                pyarrow.array([None if row[i] is None else convert(row[i]) for row in batch], type=field.type)
+                for i, (field, convert) in enumerate(zip(schema, converters))
+            ]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _product_rows():
+    products = export_products(Product.objects.order_by('-id'))
+    return (product_export_row(prod) for prod in products.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+
+
+def _pairing_set_rows():
+    pairing_sets = PairingSet.objects.order_by('pair_value').values_list('id', 'pair_value')
+    return (list(row) for row in pairing_sets.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+
+
+# Exports that are the same for every user and only change with the catalog, so their files can be reused.
+# types: non-string Parquet columns
+CACHED_EXPORTS = {
+    'products': {
+        'sheet': 'Karen Data',
+        'columns': PRODUCT_EXPORT_COLUMNS,
+        'rows': _product_rows,
+        'types': {'weight': 'float64', 'Image Count': 'int64'},
+    },
+    'pairing_sets': {
+        'sheet': 'Pairing Sets',
+        'columns': PAIRING_SET_EXPORT_COLUMNS,
+        'rows': _pairing_set_rows,
+        'types': {'ID': 'int64'},
+    },
+}
+
+EXPORT_FORMATS = {
+    'xlsx': XLSX_CONTENT_TYPE,
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def available_formats():
+    return [fmt for fmt in EXPORT_FORMATS if fmt != 'parquet' or pyarrow is not None]
+
+
+def export_key(kind, version):
+    """The export kind, a digest of its column set and the catalog version it was built from"""
+    columns = hashlib.sha256(json.dumps(CACHED_EXPORTS[kind]['columns']).encode()).hexdigest()[:12]
+    return f'{kind}-{columns}-{version}'
+
+
+def export_path(kind, version, fmt='xlsx'):
+    return os.path.join(EXPORT_CACHE_DIR, f'{export_key(kind, version)}.{fmt}')
+
+
+def _write_export(file, kind, fmt):
+    export = CACHED_EXPORTS[kind]
+    if fmt == 'csv':
+        write_csv(file, export['columns'], export['rows']())
+    elif fmt == 'parquet':
+        write_parquet(file, export['columns'], export['rows'](), export['types'])
+    else:
+        write_xlsx(file, export['sheet'], export['columns'], export['rows']())
+
+
+def build_export(kind, version=None, force=False, fmt='xlsx'):
+    """Path of the cached export of a kind for a catalog version (default: current), writing it if missing"""
+    version = version or get_catalog_version()
+    path = export_path(kind, version, fmt)
+    if not force and os.path.exists(path):
+        return path
+
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=EXPORT_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            _write_export(f, kind, fmt)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    _prune(kind, fmt, keep=path)
+    return path
+
+
+def _stream_csv_export(kind, version):
+    """CSV chunks sent to the client as they are produced, kept as the cached file once complete"""
+    export = CACHED_EXPORTS[kind]
+    path = export_path(kind, version, 'csv')
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=EXPORT_CACHE_DIR, suffix='.tmp')
+    complete = False
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in csv_chunks(export['columns'], export['rows']()):
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp_path, path)
+        complete = True
+        _prune(kind, 'csv', keep=path)
+    finally:
+        # Client went away or the query failed: drop the partial file
+        if not complete:
+            os.unlink(tmp_path)
+
+
+def _prune(kind, fmt, keep):
+    """Remove all but the EXPORT_CACHE_KEEP most recent files of an export kind and format"""
+    paths = sorted(glob.glob(os.path.join(EXPORT_CACHE_DIR, f'{kind}-*.{fmt}')), key=os.path.getmtime, reverse=True)
+    for path in paths[EXPORT_CACHE_KEEP:]:
+        if path != keep:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def cached_export_response(request, kind, filename):
+    """
+    Serve the export of a kind for the current catalog version from the cache, in the
+    ?format= asked for (xlsx by default, csv or parquet). A missing file is built first,
+    except CSV, which is streamed to the client while it is written to the cache.
+    With ?background=1 a missing file is built by a background job instead, and the
+    response is a 202 pointing at the job.
+    """
+    fmt = request.GET.get('format') or 'xlsx'
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'error': f"Unknown format, use one of: {', '.join(EXPORT_FORMATS)}"}, status=400)
+    if fmt not in available_formats():
+        return JsonResponse({'error': 'Parquet export needs pyarrow installed on the server'}, status=501)
+
+    version = get_catalog_version()
+    path = export_path(kind, version, fmt)
+    etag = f'{export_key(kind, version)}.{fmt}'
+    if not os.path.exists(path):
+        if request.GET.get('background'):
+            job = BackgroundJob.objects.filter(
+                kind='export', status__in=[BackgroundJob.QUEUED, BackgroundJob.RUNNING],
+                params__kind=kind, params__version=version, params__format=fmt,
+            ).first() or enqueue('export', params={'kind': kind, 'version': version, 'format': fmt}, user=request.user)
+            if job.status != BackgroundJob.DONE:
+                return JsonResponse({'job': job.id, 'status_url': reverse('job_status_api', args=[job.id])}, status=202)
+        elif fmt == 'csv':
+            response = StreamingHttpResponse(_stream_csv_export(kind, version), content_type=EXPORT_FORMATS[fmt])
+            response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+            response['ETag'] = quote_etag(etag)
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        else:
+            build_export(kind, version, fmt=fmt)
+
+    response = file_download(request, path, EXPORT_FORMATS[fmt], etag, filename=f'{filename}.{fmt}')
+    # Always revalidate: the ETag changes with the catalog version, and a match costs no rebuild
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@job_handler('export')
+def run_export(job, progress):
+    build_export(job.params['kind'], job.params.get('version'), fmt=job.params.get('format', 'xlsx'))
+    return {'message': 'Export ready', 'kind': job.params['kind']}
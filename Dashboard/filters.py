@@ -1,6 +1,7 @@
 import django_filters
 from .models import *
 from django.db.models import Q
+from .search import free_search_q
 
 
 class ProductFilter(django_filters.FilterSet):
@@ -14,30 +15,14 @@ class ProductFilter(django_filters.FilterSet):
     location = django_filters.CharFilter(field_name='location', lookup_expr='icontains')
     status = django_filters.CharFilter(field_name='status', lookup_expr='icontains')
     kpo = django_filters.CharFilter(field_name='kpo', lookup_expr='icontains')
-    price_min = django_filters.NumberFilter(field_name='thai_baht', lookup_expr='gte')
-    price_max = django_filters.NumberFilter(field_name='thai_baht', lookup_expr='lte')
+    price_min = django_filters.NumberFilter(field_name='thai_baht_value', lookup_expr='gte')
+    price_max = django_filters.NumberFilter(field_name='thai_baht_value', lookup_expr='lte')
     
     class Meta:
         model = Product
         fields = ['search', 'childcode', 'search_tag', 'parent_code', 'child_code', 'location', 'status', 'kpo', 'price_min', 'price_max']
 
     def filter_free_search(self, queryset, name, value):
-        # Handle combined format like "ELEC-002 - ELEC-002-E" (parent_code - child_code)
-        if ' - ' in value:
-            parts = value.split(' - ', 1)
-            if len(parts) == 2:
-                parent_part, child_part = parts
-                return queryset.filter(
-                    Q(parent_code__icontains=parent_part.strip()) &
-                    Q(child_code__icontains=child_part.strip())
-                ).distinct()
-        
-        # Default search across all fields
-        return queryset.filter(
-            Q(parent_code__icontains=value) |
-            Q(child_code__icontains=value) |
-            Q(location__icontains=value) |
-            Q(kpo__icontains=value) |
-            Q(status__icontains=value) |
-            Q(stock__icontains=value) 
-        ).distinct()
\ No newline at end of file
+        # Plain terms and the combined "PARENT - CHILD" form (e.g. "ELEC-002 - ELEC-002-E");
+        # both are served by the trigram indexes from search.create_trigram_indexes
+        return queryset.filter(free_search_q(value))
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import PIL.Image
+from django.db import IntegrityError, transaction
+from .models import Image, ImageAlias, Product, ProductImageLink
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(file):
+    """(sha256 hex digest, size in bytes) of a file, leaving it rewound"""
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return digest.hexdigest(), size
+
+
+def image_dimensions(file):
+    """(width, height) read from the image header, or (None, None) if it cannot be parsed"""
+    try:
+        with PIL.Image.open(file) as picture:
+            return picture.size
+    except (OSError, ValueError, PIL.Image.DecompressionBombError):
+        return None, None
+    finally:
+        file.seek(0)
+
+
+def image_metadata(file):
+    digest, size = file_digest(file)
+    width, height = image_dimensions(file)
+    return {'content_hash': digest, 'file_size': size, 'width': width, 'height': height}
+
+
+def store_image(uploaded_file):
+    """
+    The Image with the same bytes as an uploaded file, or a new Image saved from it.
+    Returns (image, created), like get_or_create. Identical bytes are stored once
+    whatever their file name; the upload name is recorded as an ImageAlias either way.
+    """
+    name = os.path.basename(uploaded_file.name)
+    metadata = image_metadata(uploaded_file)
+    image = Image.objects.filter(content_hash=metadata['content_hash']).first()
+    created = image is None
+    if created:
+        image = Image(image=uploaded_file, **metadata)
+        try:
+            with transaction.atomic():
+                image.save()
+        except IntegrityError:
+            # The same file was uploaded concurrently: keep theirs and drop our copy
+            image.image.delete(save=False)
+            image = Image.objects.get(content_hash=metadata['content_hash'])
+            created = False
+    # A name re-uploaded with new bytes now means the new image
+    ImageAlias.objects.update_or_create(name=name, defaults={'image': image})
+    return image, created
+
+
+def resolve_image_names(names):
+    """
+    {name: [image ids]} for the image names of a sheet, matching stored file paths as
+    well as the aliases of uploads whose bytes were already stored under another name.
+    """
+    names = set(names)
+    if not names:
+        return {}
+    upload_to = Image._meta.get_field('image').upload_to
+    paths = {f'{upload_to}{name}': name for name in names}
+    resolved = {}
+    for image_id, path in Image.objects.filter(image__in=list(paths)).order_by('id').values_list('id', 'image'):
+        resolved.setdefault(paths[path], []).append(image_id)
+    for name, image_id in ImageAlias.objects.filter(name__in=names).values_list('name', 'image_id'):
+        image_ids = resolved.setdefault(name, [])
+        if image_id not in image_ids:
+            image_ids.append(image_id)
+    return resolved
+
+
+@transaction.atomic
+def merge_duplicate(duplicate, original):
+    """Move the product and persistent links of an image onto an identical one, then delete it and its file"""
+    through = Product.images.through
+    product_ids = list(duplicate.product_set.values_list('id', flat=True))
+    through.objects.bulk_create(
+        [through(product_id=product_id, image_id=original.id) for product_id in product_ids],
+        ignore_conflicts=True,
+    )
+    ProductImageLink.objects.filter(image=duplicate).update(image=original)
+    # Sheets naming the duplicate's file keep resolving, now to the original
+    ImageAlias.objects.filter(image=duplicate).update(image=original)
+    ImageAlias.objects.get_or_create(name=os.path.basename(duplicate.image.name), defaults={'image': original})
+    if duplicate.image.name != original.image.name:
+        duplicate.image.delete(save=False)
+    # post_delete refreshes the summaries of the products that were linked
+    duplicate.delete()
@@ -0,0 +1,722 @@
+import csv
+import hashlib
+import json
+import tempfile
+from contextlib import ExitStack
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .caching import bump_catalog_version
+from .ingest import TableReader, iter_records
+from .jobs import job_handler
+from .images import resolve_image_names
+from .labels import assign_label_paths
+from .models import Image, ImageAlias, ImageName, PairingSet, Product, ProductImageLink, Tag
+
+
+IMPORT_CHUNK_SIZE = getattr(settings, 'IMPORT_CHUNK_SIZE', 1000)
+
+# Accepted header spellings per column, matched case-insensitively
+PRODUCT_COLUMNS = {
+    'parent_code': ['parent code', 'parent_code'],
+    'child_code': ['child code', 'child_code'],
+    'location': ['location'],
+    'stock': ['qty', 'stock', 'quantity'],
+    'kpo': ['kpo'],
+    'pairing_set': ['pairing set', 'pairing_set', 'pairing sets'],
+    'weight': ['weight'],
+    'thai_baht': ['thai baht', 'thai_baht', 'thb'],
+    'usd_rate': ['usd rate', 'usd_rate', 'usd dollar', 'usd'],
+    'euro_rate': ['euro rate', 'euro_rate', 'eur'],
+    'note_1': ['note 1', 'note_1'],
+    'note_2': ['note 2', 'note_2'],
+    'category': ['category', 'tag'],
+    'unit': ['unit'],
+    'description': ['product description', 'description'],
+    'images_names': ['images', 'image names', 'images names', 'image_names'],
+}
+REQUIRED_PRODUCT_COLUMNS = [
+    'parent_code', 'child_code', 'location', 'stock', 'weight',
+    'thai_baht', 'usd_rate', 'euro_rate', 'note_1', 'note_2',
+]
+# Columns written on every row; description and unit only when the sheet has a value
+UPDATE_FIELDS = ['location', 'stock', 'kpo', 'weight', 'thai_baht', 'usd_rate', 'euro_rate', 'note_1', 'note_2']
+FINGERPRINT_FIELDS = UPDATE_FIELDS + ['description', 'unit', 'category']
+MAX_REPORTED_CHANGES = 1000
+# Text columns checked against their max_length before anything is written
+LENGTH_CHECKED_FIELDS = ['parent_code', 'child_code', 'location', 'stock', 'kpo', 'thai_baht', 'usd_rate', 'euro_rate', 'unit']
+
+
+def product_records(rows):
+    """Product sheet rows as dicts keyed by PRODUCT_COLUMNS; raises MissingColumnsError for a bad header"""
+    return iter_records(rows, PRODUCT_COLUMNS, header=True, required=REQUIRED_PRODUCT_COLUMNS)
+
+
+def parse_product_row(record):
+    """One product record as a dict of product values, or None for rows without a parent code"""
+    if not record['parent_code']:
+        return None
+
+    def split(column):
+        raw = record[column]
+        return [str(item).strip() for item in str(raw).split(',')] if raw else None
+
+    try:
+        weight = Decimal(str(record['weight'])) if record['weight'] is not None else Decimal('0.00')
+    except (ValueError, TypeError, InvalidOperation):
+        weight = Decimal('0.00')
+    category = record['category']
+    return dict(
+        record,
+        weight=weight,
+        category=str(category).strip() if category else None,
+        pairing_set=split('pairing_set'),
+        images_names=split('images_names'),
+    )
+
+
+def product_row_error(row):
+    """Why a parsed row cannot be saved, or None; such rows are skipped and reported instead of failing their chunk"""
+    if row['child_code'] is None or not str(row['child_code']).strip():
+        return 'child code is missing'
+    if row['location'] is None:
+        return 'location is missing'
+    for field in LENGTH_CHECKED_FIELDS:
+        max_length = Product._meta.get_field(field).max_length
+        if row[field] is not None and len(str(row[field])) > max_length:
+            return f'{field} is longer than {max_length} characters'
+    weight = Product._meta.get_field('weight')
+    if not row['weight'].is_finite() or abs(row['weight']) >= 10 ** (weight.max_digits - weight.decimal_places):
+        return f"weight {row['weight']} is out of range"
+    return None
+
+
+def _row_error(errors, seen, row, error):
+    # seen counts data rows; the header is sheet row 1
+    if len(errors) < MAX_REPORTED_CHANGES:
+        errors.append(f"Row {seen + 1} ({row['child_code']}): {error}")
+
+
+def import_product_rows(rows, chunk_size=IMPORT_CHUNK_SIZE, progress=None, dry_run=False):
+    """
+    Create or update products from parsed rows (see parse_product_row), one transaction
+    per chunk. The whole sheet is read first and repeated child codes are merged into
+    the row a one-by-one import would end up writing (see merge_product_rows), so each
+    product is compared, written and reported once whichever chunks its rows fell in.
+    Products whose fingerprint matches the one stored by the previous import are skipped,
+    and rows that cannot be saved (see product_row_error) are left out and reported.
+    With dry_run every chunk is rolled back, leaving only the report.
+    progress, if given, is called with the number of rows consumed after each chunk.
+    Returns counts of created, updated and unchanged products plus the first
+    MAX_REPORTED_CHANGES changes as {'child_code', 'action', 'fields'} dicts and
+    row errors as 'Row n (code): reason' strings.
+    """
+    merged, errors, seen = merge_product_rows(rows)
+    merged = list(merged.values())
+    totals = {'created': 0, 'updated': 0, 'unchanged': 0, 'changes': [], 'errors': errors}
+    for start in range(0, len(merged), chunk_size):
+        _add_counts(totals, _import_chunk(merged[start:start + chunk_size], dry_run))
+        if progress:
+            # Rows are consumed up front; report the share of products written so far
+            progress(seen * min(start + chunk_size, len(merged)) // len(merged))
+    if progress:
+        progress(seen)
+    return totals
+
+
+def merge_product_rows(rows):
+    """
+    Collapse parsed rows into one row per child_code, in order of first appearance, the
+    way applying them one by one would: the listed columns come from the last row,
+    description and unit from the last row giving one, category, pairing sets and image
+    names from the last row listing any, and parent_code from the first row, as only new
+    products take it. Returns ({child_code: row}, row errors, number of rows read).
+    """
+    merged = {}
+    errors = []
+    seen = 0
+    for row in rows:
+        seen += 1
+        if row is None:
+            continue
+        error = product_row_error(row)
+        if error:
+            _row_error(errors, seen, row, error)
+            continue
+        code = str(row['child_code'])
+        if code not in merged:
+            merged[code] = dict(row)
+            continue
+        kept = merged[code]
+        for field in UPDATE_FIELDS:
+            kept[field] = row[field]
+        for field in ('description', 'unit'):
+            if row[field] is not None:
+                kept[field] = row[field]
+        for field in ('category', 'pairing_set', 'images_names'):
+            if row[field]:
+                kept[field] = row[field]
+    return merged, errors, seen
+
+
+def _add_counts(totals, counts):
+    for key, count in counts.items():
+        if key == 'changes':
+            totals[key].extend(count[:MAX_REPORTED_CHANGES - len(totals[key])])
+        else:
+            totals[key] += count
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def row_fingerprint(row, image_ids):
+    """
+    sha256 of everything a row writes to an existing product, including the images its
+    names resolve to, so a newly uploaded image also counts as a change. parent_code is
+    left out because only new products take it from the sheet.
+    """
+    values = [_text(row[field]) for field in FINGERPRINT_FIELDS]
+    values += [row['pairing_set'], row['images_names'], sorted(image_ids) if row['images_names'] else None]
+    return hashlib.sha256(json.dumps(values).encode()).hexdigest()
+
+
+def _field_changes(product, row, related):
+    """{field: [old, new]} for the values a row would change on an existing product"""
+    changes = {}
+    for field in UPDATE_FIELDS + ['description', 'unit']:
+        if field in ('description', 'unit') and row[field] is None:
+            continue
+        old, new = getattr(product, field), row[field]
+        same = Decimal(old) == new if field == 'weight' else _text(old) == _text(new)
+        if not same:
+            changes[field] = [_text(old), _text(new)]
+    if row['category'] and (product.tag.name if product.tag else None) != row['category']:
+        changes['tag'] = [product.tag.name if product.tag else None, row['category']]
+    for field, new in (('pairing_set', row['pairing_set']), ('images_names', row['images_names']), ('images', row['image_ids'])):
+        if new is None:
+            continue
+        old = sorted(related[field].get(product.id, []))
+        if old != sorted(set(new)):
+            changes[field] = [old, sorted(set(new))]
+    return changes
+
+
+def _related_values(product_ids):
+    """Current pairing set values, image names and image ids of products, keyed by product id"""
+    related = {'pairing_set': {}, 'images_names': {}, 'images': {}}
+    if not product_ids:
+        return related
+    for field, through, value in (
+        ('pairing_set', Product.pairing_set.through, 'pairingset__pair_value'),
+        ('images_names', Product.images_names.through, 'imagename__name'),
+        ('images', Product.images.through, 'image_id'),
+    ):
+        for product_id, related_value in through.objects.filter(product_id__in=product_ids).values_list('product_id', value):
+            related[field].setdefault(product_id, []).append(related_value)
+    return related
+
+
+def _lookup(model, field, values):
+    """Existing rows of a model keyed by field, creating the missing ones in bulk"""
+    values = set(values)
+    if not values:
+        return {}
+    found = {}
+    for obj in model.objects.filter(**{f'{field}__in': values}).order_by('id'):
+        found.setdefault(getattr(obj, field), obj)
+    missing = [model(**{field: value}) for value in values if value not in found]
+    if missing:
+        # Unique lookups may have been created concurrently; re-read instead of trusting returned pks
+        model.objects.bulk_create(missing, ignore_conflicts=True)
+        for obj in model.objects.filter(**{f'{field}__in': [getattr(m, field) for m in missing]}).order_by('id'):
+            found.setdefault(getattr(obj, field), obj)
+    return found
+
+
+def _set_relation(through, product_field, related_field, assignments):
+    """Replace the m2m rows of each product with the given related ids, as Manager.set() would"""
+    if not assignments:
+        return
+    through.objects.filter(**{f'{product_field}__in': list(assignments)}).delete()
+    through.objects.bulk_create([
+        through(**{product_field: product_id, related_field: related_id})
+        for product_id, related_ids in assignments.items()
+        for related_id in dict.fromkeys(related_ids)
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+@transaction.atomic
+def _import_chunk(rows, dry_run=False):
+    codes = {str(row['child_code']) for row in rows}
+    products = {}
+    for product in Product.objects.filter(child_code__in=codes).select_related('tag').order_by('id'):
+        products.setdefault(product.child_code, product)
+
+    images = resolve_image_names(name for row in rows for name in row['images_names'] or [])
+
+    # Change detection: drop rows that would write exactly what the previous import wrote
+    pending = []
+    unchanged = 0
+    for row in rows:
+        code = str(row['child_code'])
+        row['image_ids'] = None
+        if row['images_names']:
+            row['image_ids'] = [
+                image_id for name in row['images_names'] for image_id in images.get(name, [])
+            ]
+        row['fingerprint'] = row_fingerprint(row, row['image_ids'] or [])
+        product = products.get(code)
+        if product is not None and product.import_fingerprint == row['fingerprint']:
+            unchanged += 1
+            continue
+        pending.append(row)
+    rows = pending
+
+    related = _related_values([products[code].id for code in (str(row['child_code']) for row in rows) if code in products])
+    changes = []
+    stamp_only = {}
+    for row in rows:
+        code = str(row['child_code'])
+        product = products.get(code)
+        if product is None:
+            changes.append({'child_code': code, 'action': 'create', 'fields': {}})
+            continue
+        fields = _field_changes(product, row, related)
+        if fields:
+            changes.append({'child_code': code, 'action': 'update', 'fields': fields})
+        else:
+            # Nothing differs, the product just has no fingerprint yet
+            stamp_only[code] = row
+    for code, row in stamp_only.items():
+        products[code].import_fingerprint = row['fingerprint']
+    rows = [row for row in rows if str(row['child_code']) not in stamp_only]
+    unchanged += len(stamp_only)
+    if not dry_run:
+        Product.objects.bulk_update([products[code] for code in stamp_only], ['import_fingerprint'], batch_size=1000)
+
+    if not rows:
+        return {'created': 0, 'updated': 0, 'unchanged': unchanged, 'changes': changes}
+
+    tags = _lookup(Tag, 'name', (row['category'] for row in rows if row['category']))
+    pairings = _lookup(PairingSet, 'pair_value', (value for row in rows for value in row['pairing_set'] or []))
+    image_names = _lookup(ImageName, 'name', (name for row in rows for name in row['images_names'] or []))
+
+    created = {}
+    pairing_assignments = {}
+    name_assignments = {}
+    for row in rows:
+        code = str(row['child_code'])
+        product = products.get(code)
+        if product is None:
+            product = Product(
+                parent_code=row['parent_code'], child_code=row['child_code'], location=row['location'],
+                stock=row['stock'], kpo=row['kpo'], weight=row['weight'], thai_baht=row['thai_baht'],
+                usd_rate=row['usd_rate'], euro_rate=row['euro_rate'], note_1=row['note_1'], note_2=row['note_2'],
+                description=row['description'] or None, unit=row['unit'] or None,
+            )
+            products[code] = created[code] = product
+        else:
+            for field in UPDATE_FIELDS:
+                setattr(product, field, row[field])
+            if row['description'] is not None:
+                product.description = row['description']
+            if row['unit'] is not None:
+                product.unit = row['unit']
+        if row['category']:
+            product.tag = tags[row['category']]
+        if row['pairing_set']:
+            pairing_assignments[code] = [pairings[value].id for value in row['pairing_set']]
+        if row['images_names']:
+            name_assignments[code] = [image_names[name] for name in row['images_names']]
+        product.import_fingerprint = row['fingerprint']
+
+    written = {code: products[code] for code in {str(row['child_code']) for row in rows}}
+    for product in written.values():
+        product.sync_numeric_fields()
+        assign_label_paths(product)
+
+    Product.objects.bulk_create(list(created.values()), batch_size=1000)
+    updated = [product for code, product in written.items() if code not in created]
+    Product.objects.bulk_update(updated, [
+        'location', 'stock', 'kpo', 'weight', 'thai_baht', 'usd_rate', 'euro_rate', 'note_1', 'note_2',
+        'description', 'unit', 'tag', 'qrcode_image', 'barcode_image', 'import_fingerprint',
+        *Product.NUMERIC_FIELDS.values(),
+    ], batch_size=1000)
+
+    # New products pick up images linked to their codes before they were (re)created, as Product.save() does
+    image_assignments = {}
+    if created:
+        links = ProductImageLink.objects.filter(
+            child_code__in=[product.child_code for product in created.values()]
+        ).values_list('parent_code', 'child_code', 'image_id')
+        linked = {}
+        for parent_code, child_code, image_id in links:
+            linked.setdefault((str(parent_code), str(child_code)), []).append(image_id)
+        Product.images.through.objects.bulk_create([
+            Product.images.through(product_id=product.id, image_id=image_id)
+            for code, product in created.items()
+            for image_id in linked.get((str(product.parent_code), code), [])
+        ], batch_size=1000, ignore_conflicts=True)
+    for code, names in name_assignments.items():
+        image_assignments[products[code].id] = [
+            image_id for name in names for image_id in images.get(name.name, [])
+        ]
+
+    _set_relation(Product.pairing_set.through, 'product_id', 'pairingset_id',
+                  {products[code].id: ids for code, ids in pairing_assignments.items()})
+    _set_relation(Product.images_names.through, 'product_id', 'imagename_id',
+                  {products[code].id: [name.id for name in names] for code, names in name_assignments.items()})
+    _set_relation(Product.images.through, 'product_id', 'image_id', image_assignments)
+    Product.refresh_image_summaries([product.id for product in created.values()] + list(image_assignments))
+    if dry_run:
+        transaction.set_rollback(True)
+    else:
+        # Stamped last, right before commit: sync clients only hold back SYNC_SETTLE_SECONDS
+        # for rows that commit after their updated_at
+        Product.objects.filter(pk__in=[product.pk for product in written.values()]).update(updated_at=timezone.now())
+        # Bulk writes send no signals
+        bump_catalog_version()
+
+    return {'created': len(created), 'updated': len(updated), 'unchanged': unchanged, 'changes': changes}
+
+
+# Staged rows are spooled to disk past this size instead of held in memory
+COPY_SPOOL_SIZE = 32 * 2 ** 20
+COPY_NULL = '\\N'
+
+STAGE_COLUMNS = [
+    'row_no', 'parent_code', 'child_code', 'location', 'stock', 'kpo', 'weight', 'thai_baht', 'usd_rate',
+    'euro_rate', 'note_1', 'note_2', 'description', 'unit', 'category', 'thai_baht_value', 'usd_rate_value',
+    'euro_rate_value', 'stock_value', 'qrcode_image', 'barcode_image',
+]
+
+
+def copy_import_product_rows(rows, progress=None, dry_run=False):
+    """
+    Load parsed rows (see parse_product_row) for very large catalogs: rows are COPYed into
+    temporary staging tables and merged into products, pairing sets, image names and image
+    links with set-based SQL in one transaction, followed by one catalog version bump.
+    Per-row Python work (numeric columns, label paths) happens while staging, so the merge
+    needs no round trips per product. Repeated codes merge as in import_product_rows.
+    Fingerprints are not stored, so the next incremental import compares field by field.
+    No per-row report is built, so dry runs are refused; use import_product_rows for those.
+    On PostgreSQL returns {'created': n, 'updated': n, 'unchanged': 0, 'changes': [],
+    'errors': [...]}: every staged product counts as created or updated. Other databases
+    fall back to import_product_rows and get its full report, with unchanged counts and changes.
+    """
+    if dry_run:
+        raise ValueError('The COPY importer cannot do a dry run; import without COPY mode to preview changes')
+    if connection.vendor != 'postgresql':
+        return import_product_rows(rows, progress=progress, dry_run=dry_run)
+
+    with ExitStack() as stack:
+        stage, pairings, names = (
+            stack.enter_context(tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_SIZE, mode='w+', newline=''))
+            for _ in range(3)
+        )
+        seen, errors = _stage_rows(rows, stage, pairings, names, progress)
+        for f in (stage, pairings, names):
+            f.seek(0)
+        with transaction.atomic():
+            counts = _merge_staged(stage, pairings, names)
+            bump_catalog_version()
+    if progress:
+        progress(seen)
+    return dict(counts, unchanged=0, changes=[], errors=errors)
+
+
+def _stage_rows(rows, stage, pairings, names, progress):
+    """Write rows as COPY csv into the three staging files; returns the number of rows read and the row errors"""
+    stage_writer, pairing_writer, name_writer = (csv.writer(f) for f in (stage, pairings, names))
+    errors = []
+    seen = 0
+    for row in rows:
+        seen += 1
+        if progress and seen % IMPORT_CHUNK_SIZE == 0:
+            progress(seen)
+        if row is None:
+            continue
+        error = product_row_error(row)
+        if error:
+            _row_error(errors, seen, row, error)
+            continue
+        product = Product(child_code=row['child_code'], thai_baht=row['thai_baht'], usd_rate=row['usd_rate'],
+                          euro_rate=row['euro_rate'], stock=row['stock'])
+        product.sync_numeric_fields()
+        assign_label_paths(product)
+        values = dict(
+            row, row_no=seen, description=row['description'] or None, unit=row['unit'] or None,
+            thai_baht_value=product.thai_baht_value, usd_rate_value=product.usd_rate_value,
+            euro_rate_value=product.euro_rate_value, stock_value=product.stock_value,
+            qrcode_image=product.qrcode_image.name, barcode_image=product.barcode_image.name,
+        )
+        stage_writer.writerow([COPY_NULL if values[column] is None else values[column] for column in STAGE_COLUMNS])
+        for value in dict.fromkeys(row['pairing_set'] or []):
+            pairing_writer.writerow([seen, value])
+        for name in dict.fromkeys(row['images_names'] or []):
+            name_writer.writerow([seen, name])
+    return seen, errors
+
+
+def _merge_staged(stage, pairings, names):
+    q = connection.ops.quote_name
+    product = q(Product._meta.db_table)
+    tag = q(Tag._meta.db_table)
+    pairing_set = q(PairingSet._meta.db_table)
+    image_name = q(ImageName._meta.db_table)
+    image = q(Image._meta.db_table)
+    image_link = q(ProductImageLink._meta.db_table)
+    image_alias = q(ImageAlias._meta.db_table)
+    product_pairings = q(Product.pairing_set.through._meta.db_table)
+    product_names = q(Product.images_names.through._meta.db_table)
+    product_images = q(Product.images.through._meta.db_table)
+    image_prefix = Image._meta.get_field('image').upload_to
+    now = timezone.now()
+    copy_options = f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMPORARY TABLE import_stage ('
+            'row_no bigint PRIMARY KEY, parent_code text, child_code text, location text, stock text, kpo text, '
+            'weight numeric(6, 2), thai_baht text, usd_rate text, euro_rate text, note_1 text, note_2 text, '
+            'description text, unit text, category text, thai_baht_value numeric(20, 6), '
+            'usd_rate_value numeric(20, 6), euro_rate_value numeric(20, 6), stock_value integer, '
+            'qrcode_image text, barcode_image text, tag_id bigint, product_id bigint, '
+            'created boolean NOT NULL DEFAULT false'
+            ') ON COMMIT DROP'
+        )
+        cursor.execute('CREATE TEMPORARY TABLE import_stage_pairing (row_no bigint, value text) ON COMMIT DROP')
+        cursor.execute('CREATE TEMPORARY TABLE import_stage_name (row_no bigint, value text) ON COMMIT DROP')
+        cursor.copy_expert(f'COPY import_stage ({", ".join(STAGE_COLUMNS)}) {copy_options}', stage)
+        cursor.copy_expert(f'COPY import_stage_pairing (row_no, value) {copy_options}', pairings)
+        cursor.copy_expert(f'COPY import_stage_name (row_no, value) {copy_options}', names)
+        cursor.execute('CREATE INDEX ON import_stage (child_code)')
+        cursor.execute('CREATE INDEX ON import_stage_pairing (row_no)')
+        cursor.execute('CREATE INDEX ON import_stage_name (row_no)')
+        for table in ('import_stage', 'import_stage_pairing', 'import_stage_name'):
+            cursor.execute(f'ANALYZE {table}')
+
+        # Repeated codes collapse into their last row with the ORM importer's rules: new products
+        # take the first row's parent code, description, unit and category keep the last value
+        # given, and pairing sets and image names come from the last row that lists any
+        cursor.execute(
+            'UPDATE import_stage s SET parent_code = d.parent_code, description = d.description, '
+            'unit = d.unit, category = d.category FROM ('
+            'SELECT MAX(row_no) AS row_no, (ARRAY_AGG(parent_code ORDER BY row_no))[1] AS parent_code, '
+            + ', '.join(
+                f'(ARRAY_AGG({column} ORDER BY row_no DESC) FILTER (WHERE {column} IS NOT NULL))[1] AS {column}'
+                for column in ('description', 'unit', 'category')
+            ) +
+            ' FROM import_stage GROUP BY child_code HAVING COUNT(*) > 1'
+            ') d WHERE s.row_no = d.row_no'
+        )
+        for staged in ('import_stage_pairing', 'import_stage_name'):
+            cursor.execute(
+                f'WITH listed AS ('
+                f'SELECT s.child_code, MAX(s.row_no) AS row_no FROM import_stage s '
+                f'WHERE s.row_no IN (SELECT row_no FROM {staged}) GROUP BY s.child_code'
+                f'), kept AS ('
+                f'SELECT child_code, MAX(row_no) AS row_no FROM import_stage GROUP BY child_code HAVING COUNT(*) > 1'
+                f') UPDATE {staged} x SET row_no = kept.row_no FROM listed JOIN kept ON kept.child_code = listed.child_code '
+                f'WHERE x.row_no = listed.row_no AND listed.row_no <> kept.row_no'
+            )
+        # Rows of the earlier duplicates, and their remaining pairing and name rows, are then ignored
+        cursor.execute(
+            'DELETE FROM import_stage s USING import_stage later '
+            'WHERE later.child_code = s.child_code AND later.row_no > s.row_no'
+        )
+
+        # Match existing products the way the ORM importer does: lowest id per child_code
+        cursor.execute(
+            f'UPDATE import_stage s SET product_id = p.id FROM ('
+            f'SELECT child_code, MIN(id) AS id FROM {product} '
+            f'WHERE child_code IN (SELECT child_code FROM import_stage) GROUP BY child_code'
+            f') p WHERE p.child_code = s.child_code'
+        )
+
+        # Tag names are not unique: create the missing ones, then use the lowest id per name
+        cursor.execute(
+            f'INSERT INTO {tag} (name) SELECT DISTINCT s.category FROM import_stage s '
+            f'WHERE s.category IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {tag} t WHERE t.name = s.category)'
+        )
+        cursor.execute(
+            f'UPDATE import_stage s SET tag_id = t.id FROM ('
+            f'SELECT name, MIN(id) AS id FROM {tag} '
+            f'WHERE name IN (SELECT category FROM import_stage) GROUP BY name'
+            f') t WHERE t.name = s.category'
+        )
+
+        numeric_columns = list(Product.NUMERIC_FIELDS.values())
+        cursor.execute(
+            f'UPDATE {product} p SET '
+            + ', '.join(f'{column} = s.{column}' for column in UPDATE_FIELDS + numeric_columns) + ', '
+            'description = COALESCE(s.description, p.description), unit = COALESCE(s.unit, p.unit), '
+            'tag_id = COALESCE(s.tag_id, p.tag_id), qrcode_image = s.qrcode_image, '
+            'barcode_image = s.barcode_image, updated_at = %s, import_fingerprint = NULL '
+            'FROM import_stage s WHERE p.id = s.product_id',
+            [now],
+        )
+        updated = cursor.rowcount
+
+        insert_columns = ['parent_code', 'child_code', *UPDATE_FIELDS, 'description', 'unit', 'tag_id',
+                          *numeric_columns, 'qrcode_image', 'barcode_image']
+        cursor.execute(
+            f'WITH inserted AS ('
+            f'INSERT INTO {product} ({", ".join(insert_columns)}, image_count, created_at, updated_at) '
+            f'SELECT {", ".join(insert_columns)}, 0, %s, %s FROM import_stage '
+            f'WHERE product_id IS NULL ORDER BY row_no RETURNING id, child_code'
+            f') UPDATE import_stage s SET product_id = inserted.id, created = true '
+            f'FROM inserted WHERE inserted.child_code = s.child_code',
+            [now, now],
+        )
+        created = cursor.rowcount
+
+        # Pairing sets and image names: create missing values, then replace the links of staged products
+        for lookup, column, staged, through, related_column in (
+            (pairing_set, 'pair_value', 'import_stage_pairing', product_pairings, 'pairingset_id'),
+            (image_name, 'name', 'import_stage_name', product_names, 'imagename_id'),
+        ):
+            cursor.execute(
+                f'INSERT INTO {lookup} ({column}) SELECT DISTINCT x.value FROM {staged} x '
+                f'JOIN import_stage s ON s.row_no = x.row_no ON CONFLICT ({column}) DO NOTHING'
+            )
+            cursor.execute(
+                f'DELETE FROM {through} t USING import_stage s '
+                f'WHERE t.product_id = s.product_id AND s.row_no IN (SELECT row_no FROM {staged})'
+            )
+            cursor.execute(
+                f'INSERT INTO {through} (product_id, {related_column}) '
+                f'SELECT DISTINCT s.product_id, l.id FROM import_stage s '
+                f'JOIN {staged} x ON x.row_no = s.row_no JOIN {lookup} l ON l.{column} = x.value '
+                f'ON CONFLICT DO NOTHING'
+            )
+
+        # New products pick up images linked to their codes, as Product.save() does
+        cursor.execute(
+            f'INSERT INTO {product_images} (product_id, image_id) '
+            f'SELECT s.product_id, l.image_id FROM import_stage s JOIN {image_link} l '
+            f'ON l.parent_code = s.parent_code AND l.child_code = s.child_code WHERE s.created '
+            f'ON CONFLICT DO NOTHING'
+        )
+        # Image names replace the product's images with the uploads of the same name, stored or aliased
+        cursor.execute(
+            f'DELETE FROM {product_images} t USING import_stage s '
+            f'WHERE t.product_id = s.product_id AND s.row_no IN (SELECT row_no FROM import_stage_name)'
+        )
+        cursor.execute(
+            f'INSERT INTO {product_images} (product_id, image_id) '
+            f'SELECT DISTINCT s.product_id, i.id FROM import_stage s '
+            f'JOIN import_stage_name x ON x.row_no = s.row_no JOIN {image} i ON i.image = %s || x.value '
+            f'UNION SELECT s.product_id, a.image_id FROM import_stage s '
+            f'JOIN import_stage_name x ON x.row_no = s.row_no JOIN {image_alias} a ON a.name = x.value '
+            f'ON CONFLICT DO NOTHING',
+            [image_prefix],
+        )
+
+        # Same summaries as Product.refresh_image_summaries
+        cursor.execute(
+            f'UPDATE {product} p SET image_count = COALESCE(c.image_count, 0), primary_image_id = c.first_image '
+            f'FROM import_stage s LEFT JOIN ('
+            f'SELECT product_id, COUNT(image_id) AS image_count, MIN(image_id) AS first_image FROM {product_images} '
+            f'WHERE product_id IN (SELECT product_id FROM import_stage) GROUP BY product_id'
+            f') c ON c.product_id = s.product_id '
+            f'WHERE p.id = s.product_id AND (s.created OR s.row_no IN (SELECT row_no FROM import_stage_name))'
+        )
+        # Stamped last, right before commit, as the ORM importer does
+        cursor.execute(
+            f'UPDATE {product} p SET updated_at = %s FROM import_stage s WHERE p.id = s.product_id',
+            [timezone.now()],
+        )
+        # Dropped here as well as on commit, in case the caller's transaction goes on to stage again
+        cursor.execute('DROP TABLE import_stage, import_stage_pairing, import_stage_name')
+
+    return {'created': created, 'updated': updated}
+
+
+def read_pairing_values(rows):
+    """Non-empty values of the first column of a pairing set sheet (no header row)"""
+    values = []
+    for record in iter_records(rows, {'value': []}, header=False, defaults={'value': 0}):
+        if record['value'] is not None:
+            value = str(record['value']).strip()
+            if value:
+                values.append(value)
+    return values
+
+
+def import_pairing_values(values):
+    """
+    Create the pairing sets that do not exist yet in one bulk insert. Values already
+    present, in the database or earlier in the list, are skipped.
+    Returns {'created': n, 'skipped': n, 'errors': [...]}.
+    """
+    max_length = PairingSet._meta.get_field('pair_value').max_length
+    existing = set()
+    distinct = list(dict.fromkeys(values))
+    for start in range(0, len(distinct), 1000):
+        existing.update(
+            PairingSet.objects.filter(pair_value__in=distinct[start:start + 1000]).values_list('pair_value', flat=True)
+        )
+    new = {}
+    skipped = 0
+    errors = []
+    for value in values:
+        if value in existing or value in new:
+            skipped += 1
+        elif len(value) > max_length:
+            errors.append(f"{value}: longer than {max_length} characters")
+        else:
+            new[value] = PairingSet(pair_value=value)
+    PairingSet.objects.bulk_create(list(new.values()), batch_size=1000, ignore_conflicts=True)
+    if new:
+        bump_catalog_version()
+    return {'created': len(new), 'skipped': skipped, 'errors': errors}
+
+
+def pairing_import_message(counts):
+    message = f"Excel upload completed: {counts['created']} pairing set(s) created"
+    if counts['skipped'] > 0:
+        message += f", {counts['skipped']} skipped (already exist)"
+    if counts['errors']:
+        message += '. Errors: ' + '; '.join(counts['errors'][:3])
+        if len(counts['errors']) > 3:
+            message += f" and {len(counts['errors']) - 3} more errors."
+    return message
+
+
+@job_handler('product_import')
+def run_product_import(job, progress):
+    with job.upload.open('rb') as f, TableReader(f, job.upload.name) as reader:
+        if reader.total_rows:
+            progress.set_total(max(reader.total_rows - 1, 0))
+        records = product_records(reader.rows())
+        load = copy_import_product_rows if job.params.get('mode') == 'copy' else import_product_rows
+        counts = load(
+            (parse_product_row(record) for record in records),
+            progress=progress.advance,
+            dry_run=job.params.get('dry_run', False),
+        )
+    for error in counts['errors']:
+        progress.error(error)
+    summary = f"{counts['created']} created, {counts['updated']} updated, {counts['unchanged']} unchanged."
+    if counts['errors']:
+        summary += f" {len(counts['errors'])} row(s) skipped with errors."
+    if job.params.get('dry_run'):
+        return dict(counts, dry_run=True, message=f"Dry run, nothing was saved: {summary}")
+    return dict(counts, message=f"Successfully saved data from file! {summary}")
+
+
+@job_handler('pairing_set_import')
+def run_pairing_set_import(job, progress):
+    with job.upload.open('rb') as f, TableReader(f, job.upload.name) as reader:
+        values = read_pairing_values(reader.rows())
+    if not values:
+        raise ValueError('No valid pairing set values found in the Excel file.')
+    progress.set_total(len(values))
+    counts = import_pairing_values(values)
+    for error in counts['errors']:
+        progress.error(error)
+    return dict(counts, message=pairing_import_message(counts))
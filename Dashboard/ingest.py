@@ -0,0 +1,129 @@
+import codecs
+import csv
+import os
+from django.conf import settings
+from openpyxl import load_workbook
+
+
+# Imports abort instead of pushing a worker past this resident set size (MB); None disables the check
+INGEST_MAX_RSS_MB = getattr(settings, 'INGEST_MAX_RSS_MB', 768)
+MEMORY_CHECK_INTERVAL = 500
+
+
+class IngestError(ValueError):
+    pass
+
+
+class MissingColumnsError(IngestError):
+    pass
+
+
+class MemoryCeilingExceeded(IngestError):
+    pass
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB, or None where it cannot be read"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class TableReader:
+    """
+    Streams the rows of an uploaded .xlsx (openpyxl read-only mode, one row in memory
+    at a time) or .csv file as tuples, with empty cells as None either way.
+    """
+
+    def __init__(self, file, name=None):
+        self.file = file
+        self.name = (name or getattr(file, 'name', '') or '').lower()
+        self.is_csv = self.name.endswith('.csv')
+        self.workbook = None
+        if not self.is_csv:
+            self.workbook = load_workbook(file, read_only=True, data_only=True)
+
+    @property
+    def total_rows(self):
+        """Row count from the sheet's dimensions when the file records them, else None"""
+        if self.workbook is None:
+            return None
+        return self.workbook.active.max_row
+
+    def _raw_rows(self):
+        if self.is_csv:
+            self.file.seek(0)
+            for row in csv.reader(codecs.getreader('utf-8-sig')(self.file)):
+                yield tuple(value if value.strip() else None for value in row)
+        else:
+            yield from self.workbook.active.iter_rows(values_only=True)
+
+    def rows(self):
+        for count, row in enumerate(self._raw_rows(), 1):
+            if INGEST_MAX_RSS_MB and count % MEMORY_CHECK_INTERVAL == 0:
+                rss = current_rss_mb()
+                if rss is not None and rss > INGEST_MAX_RSS_MB:
+                    raise MemoryCeilingExceeded(
+                        f'Import stopped at row {count}: memory use {rss:.0f} MB is above the {INGEST_MAX_RSS_MB} MB limit'
+                    )
+            yield row
+
+    def close(self):
+        if self.workbook is not None:
+            self.workbook.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def find_columns(header, aliases):
+    """Map each column to the index of the first header cell matching one of its aliases (case-insensitive), or None"""
+    header_values = [str(value).strip().lower() if value is not None else '' for value in header]
+    return {
+        column: next((header_values.index(name) for name in names if name in header_values), None)
+        for column, names in aliases.items()
+    }
+
+
+def iter_records(rows, aliases, header=True, required=(), defaults=None):
+    """
+    Turn raw rows into dicts keyed by the columns of `aliases`, with None for absent cells.
+
+    header=True: the first row is a header and every column in `required` must be found in it.
+    header='auto': the first row is a header only if any alias matches; columns not found fall
+    back to their position in `defaults`.
+    header=False: every row is data, with columns at their position in `defaults`.
+    """
+    rows = iter(rows)
+    defaults = defaults or {}
+    indexes = {column: defaults.get(column) for column in aliases}
+    if header:
+        first = next(rows, None) or ()
+        found = find_columns(first, aliases)
+        if header == 'auto':
+            if any(index is not None for index in found.values()):
+                indexes.update({column: index for column, index in found.items() if index is not None})
+            else:
+                rows = _prepend(first, rows)
+        else:
+            indexes = found
+            if any(indexes[column] is None for column in required):
+                raise MissingColumnsError('Missing required columns in Excel header')
+
+    for row in rows:
+        row = row or ()
+        yield {
+            column: row[index] if index is not None and index < len(row) else None
+            for column, index in indexes.items()
+        }
+
+
+def _prepend(first, rows):
+    yield first
+    yield from rows
@@ -0,0 +1,187 @@
+import logging
+import threading
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import BackgroundJob
+
+
+logger = logging.getLogger(__name__)
+
+# Run jobs inside the request instead of queueing them (development without a worker)
+BACKGROUND_JOBS_INLINE = getattr(settings, 'BACKGROUND_JOBS_INLINE', False)
+# Progress is written at most this often, so large imports do not spend their time on it
+PROGRESS_INTERVAL = timedelta(seconds=1)
+MAX_STORED_ERRORS = 200
+# A running job's heartbeat is renewed this often even while its handler reports no
+# progress (one long query, a big export), well inside run_jobs' default --stale-after
+HEARTBEAT_INTERVAL = timedelta(seconds=60)
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+    """Register handler(job, progress) as the function that runs jobs of a kind"""
+    def register(handler):
+        JOB_HANDLERS[kind] = handler
+        return handler
+    return register
+
+
+class JobProgress:
+    """Handed to job handlers to report rows done and per-row errors"""
+
+    def __init__(self, job):
+        self.job = job
+        self.last_saved = None
+
+    def set_total(self, rows_total):
+        self.job.rows_total = rows_total
+        self.save(force=True)
+
+    def advance(self, rows_done):
+        self.job.rows_done = rows_done
+        self.save()
+
+    def error(self, message):
+        if len(self.job.errors) < MAX_STORED_ERRORS:
+            self.job.errors.append(str(message))
+
+    def save(self, force=False):
+        now = timezone.now()
+        if force or self.last_saved is None or now - self.last_saved >= PROGRESS_INTERVAL:
+            self.job.heartbeat_at = now
+            self.job.save(update_fields=['rows_total', 'rows_done', 'errors', 'heartbeat_at'])
+            self.last_saved = now
+
+
+class Heartbeat(threading.Thread):
+    """Keeps a running job's heartbeat_at fresh from a side thread until stopped"""
+
+    def __init__(self, job, interval=HEARTBEAT_INTERVAL):
+        super().__init__(name=f'job-{job.pk}-heartbeat', daemon=True)
+        self.job_id = job.pk
+        self.interval = interval.total_seconds()
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                BackgroundJob.objects.filter(pk=self.job_id, status=BackgroundJob.RUNNING).update(
+                    heartbeat_at=timezone.now(),
+                )
+        except Exception:
+            logger.exception('Heartbeat of background job %s failed', self.job_id)
+        finally:
+            # This thread's own database connection
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def enqueue(kind, upload=None, params=None, user=None):
+    """Store and queue a job, or run it straight away with BACKGROUND_JOBS_INLINE"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'Unknown job kind {kind!r}')
+    job = BackgroundJob.objects.create(
+        kind=kind,
+        upload=upload,
+        params=params or {},
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+    if BACKGROUND_JOBS_INLINE and claim(job):
+        run_job(job)
+    return job
+
+
+def claim(job):
+    """Atomically move a queued job to running; False if another worker got there first"""
+    now = timezone.now()
+    claimed = BackgroundJob.objects.filter(pk=job.pk, status=BackgroundJob.QUEUED).update(
+        status=BackgroundJob.RUNNING, started_at=now, heartbeat_at=now,
+    )
+    if claimed:
+        job.status, job.started_at, job.heartbeat_at = BackgroundJob.RUNNING, now, now
+    return bool(claimed)
+
+
+def claim_next(kinds=None):
+    """Oldest queued job this worker managed to claim, or None"""
+    queued = BackgroundJob.objects.filter(status=BackgroundJob.QUEUED).order_by('created_at', 'id')
+    if kinds:
+        queued = queued.filter(kind__in=kinds)
+    for job in queued[:10]:
+        if claim(job):
+            return job
+    return None
+
+
+def requeue_stale(stale_after):
+    """Put running jobs whose worker stopped sending heartbeats back in the queue"""
+    cutoff = timezone.now() - stale_after
+    return BackgroundJob.objects.filter(status=BackgroundJob.RUNNING, heartbeat_at__lt=cutoff).update(
+        status=BackgroundJob.QUEUED, started_at=None,
+    )
+
+
+def run_job(job):
+    """Run a claimed job to completion, recording its result or failure"""
+    progress = JobProgress(job)
+    heartbeat = Heartbeat(job)
+    heartbeat.start()
+    try:
+        result = JOB_HANDLERS[job.kind](job, progress)
+    except Exception as e:
+        logger.exception('Background job %s failed', job.pk)
+        job.status = BackgroundJob.FAILED
+        job.message = str(e) or e.__class__.__name__
+        job.errors.append(traceback.format_exc(limit=5))
+    else:
+        job.status = BackgroundJob.DONE
+        job.result = result
+        if isinstance(result, dict) and result.get('message'):
+            job.message = result['message']
+        if job.rows_total is not None:
+            job.rows_done = job.rows_total
+    finally:
+        heartbeat.stop()
+    job.finished_at = job.heartbeat_at = timezone.now()
+    try:
+        job.save()
+    finally:
+        # Done or failed for good: the uploaded sheet is never read again
+        if job.upload:
+            job.upload.delete(save=False)
+            BackgroundJob.objects.filter(pk=job.pk).update(upload=None)
+    return job
+
+
+def job_status(job):
+    """Status payload polled by the dashboard"""
+    eta_seconds = None
+    percent = None
+    if job.rows_total:
+        percent = round(100 * job.rows_done / job.rows_total, 1)
+        if job.status == BackgroundJob.RUNNING and job.rows_done and job.started_at:
+            elapsed = (timezone.now() - job.started_at).total_seconds()
+            eta_seconds = round(elapsed / job.rows_done * (job.rows_total - job.rows_done))
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'rows_total': job.rows_total,
+        'rows_done': job.rows_done,
+        'percent': percent,
+        'eta_seconds': eta_seconds,
+        'errors': job.errors[:20],
+        'error_count': len(job.errors),
+        'message': job.message,
+        'result': job.result,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
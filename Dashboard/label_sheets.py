@@ -0,0 +1,209 @@
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from qrcode import QRCode
+from barcode import Code39
+
+
+# A4 portrait in points; 3 x 8 labels of roughly 63.5 x 38 mm
+SHEET_LAYOUT = {
+    'page_width': 595.28,
+    'page_height': 841.89,
+    'columns': 3,
+    'rows': 8,
+    'margin_x': 14.0,
+    'margin_y': 22.0,
+    'gap_x': 7.0,
+    'gap_y': 0.0,
+    'padding': 6.0,
+    **getattr(settings, 'LABEL_SHEET_LAYOUT', {}),
+}
+LABELS_PER_PAGE = SHEET_LAYOUT['columns'] * SHEET_LAYOUT['rows']
+# Default --workers of print_label_sheets; web requests always compose in-process
+LABEL_SHEET_WORKERS = getattr(settings, 'LABEL_SHEET_WORKERS', 4)
+# Sheets shorter than this are composed in-process; a pool is not worth starting
+PARALLEL_MIN_PAGES = 4
+
+
+def label_record(prod):
+    """The fields printed on a label, as plain data that can be sent to worker processes"""
+    return {
+        'child_code': str(prod.child_code or ''),
+        'parent_code': str(prod.parent_code or ''),
+        'location': str(prod.location or ''),
+    }
+
+
+def _pdf_text(value, limit):
+    if len(value) > limit:
+        value = value[:limit - 1] + '~'
+    value = value.encode('latin-1', 'replace').decode('latin-1')
+    return value.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _runs(modules):
+    """(start, length) of each run of dark modules"""
+    start = None
+    for i, dark in enumerate(list(modules) + [False]):
+        if dark and start is None:
+            start = i
+        elif not dark and start is not None:
+            yield start, i - start
+            start = None
+
+
+def _barcode_modules(code):
+    try:
+        return [bit == '1' for bit in Code39(code).build()[0]]
+    except (KeyError, ValueError):
+        # Characters Code39 cannot encode: the label still gets its QR code and text
+        return None
+
+
+def _qr_matrix(code):
+    qr = QRCode(border=0)
+    qr.add_data(code)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def _draw_label(ops, label, x, y, width, height):
+    pad = SHEET_LAYOUT['padding']
+    code = label['child_code']
+
+    # QR code, square, on the left
+    qr_size = height - 2 * pad
+    if code:
+        matrix = _qr_matrix(code)
+        module = qr_size / len(matrix)
+        top = y + height - pad
+        for row_index, row in enumerate(matrix):
+            row_y = top - (row_index + 1) * module
+            for start, length in _runs(row):
+                ops.append(f'{x + pad + start * module:.2f} {row_y:.2f} {length * module:.2f} {module:.2f} re')
+
+    # Barcode across the upper part of the remaining width
+    left = x + 2 * pad + qr_size
+    available = x + width - pad - left
+    bars = _barcode_modules(code) if code else None
+    bar_height = height * 0.45
+    bar_y = y + height - pad - bar_height
+    if bars:
+        module = available / len(bars)
+        for start, length in _runs(bars):
+            ops.append(f'{left + start * module:.2f} {bar_y:.2f} {length * module:.2f} {bar_height:.2f} re')
+    if ops[-1].endswith(' re'):
+        ops.append('f')
+
+    # Text under the barcode
+    chars = max(int(available / 4.2), 4)
+    lines = [
+        ('F2', 8, _pdf_text(code, chars)),
+        ('F1', 6, _pdf_text(label['parent_code'], chars + 4)),
+        ('F1', 6, _pdf_text(label['location'], chars + 4)),
+    ]
+    text_y = bar_y - 9
+    for font, size, text in lines:
+        if text:
+            ops.append(f'BT /{font} {size} Tf {left:.2f} {text_y:.2f} Td ({text}) Tj ET')
+        text_y -= size + 1.5
+
+
+def compose_page(labels):
+    """Compressed PDF content stream for one sheet of up to LABELS_PER_PAGE labels"""
+    layout = SHEET_LAYOUT
+    width = (layout['page_width'] - 2 * layout['margin_x'] - (layout['columns'] - 1) * layout['gap_x']) / layout['columns']
+    height = (layout['page_height'] - 2 * layout['margin_y'] - (layout['rows'] - 1) * layout['gap_y']) / layout['rows']
+    ops = ['0 g']
+    for index, label in enumerate(labels):
+        row, column = divmod(index, layout['columns'])
+        x = layout['margin_x'] + column * (width + layout['gap_x'])
+        y = layout['page_height'] - layout['margin_y'] - (row + 1) * height - row * layout['gap_y']
+        _draw_label(ops, label, x, y, width, height)
+    return zlib.compress('\n'.join(ops).encode('latin-1'))
+
+
+def _pages(labels):
+    page = []
+    for label in labels:
+        page.append(label)
+        if len(page) == LABELS_PER_PAGE:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def _composed_pages(labels, workers):
+    """Content streams in page order, composed by a process pool a window of pages at a time"""
+    pages = _pages(labels)
+    first = []
+    for page in pages:
+        first.append(page)
+        if len(first) >= PARALLEL_MIN_PAGES:
+            break
+    if workers <= 1 or len(first) < PARALLEL_MIN_PAGES:
+        for page in first:
+            yield compose_page(page)
+        for page in pages:
+            yield compose_page(page)
+        return
+
+    window = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = [executor.submit(compose_page, page) for page in first]
+        for page in pages:
+            if len(pending) >= window:
+                yield pending.pop(0).result()
+            pending.append(executor.submit(compose_page, page))
+        for future in pending:
+            yield future.result()
+
+
+def render_label_sheets(labels, workers=1):
+    """
+    Stream a PDF of multi-up label sheets for an iterable of label_record() dicts.
+    Barcodes and QR codes are drawn as vector rectangles, so no PNG is read or written,
+    and the writer is kept minimal (base-14 Helvetica, one content stream per page)
+    rather than pulling in a PDF library. Pages are written as soon as they are
+    composed; the page tree, cross-reference table and trailer follow the last page.
+    Pages are composed in the calling process unless `workers` asks for a pool, which
+    only the print_label_sheets command does.
+    """
+    layout = SHEET_LAYOUT
+    offsets = {}
+    position = 0
+
+    def emit(number, body):
+        nonlocal position
+        offsets[number] = position
+        chunk = f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+        position += len(chunk)
+        return chunk
+
+    header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    position = len(header)
+    yield header
+    # 1: catalog and 2: page tree are written last, once every page is known
+    yield emit(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+    yield emit(4, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>')
+
+    page_numbers = []
+    number = 5
+    for content in _composed_pages(labels, workers):
+        yield emit(number, f'<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n'.encode() + content + b'\nendstream')
+        yield emit(number + 1, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {layout['page_width']} {layout['page_height']}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {number} 0 R >>"
+        ).encode())
+        page_numbers.append(number + 1)
+        number += 2
+
+    kids = ' '.join(f'{page} 0 R' for page in page_numbers)
+    yield emit(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(page_numbers)} >>'.encode())
+    yield emit(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+
+    xref = [f'xref\n0 {number}\n', '0000000000 65535 f \n']
+    xref += [f'{offsets[i]:010d} 00000 n \n' for i in range(1, number)]
+    xref.append(f'trailer\n<< /Size {number} /Root 1 0 R >>\nstartxref\n{position}\n%%EOF\n')
+    yield ''.join(xref).encode()
@@ -0,0 +1,98 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+from django.conf import settings
+from qrcode import make
+from barcode import Code39
+from barcode.writer import ImageWriter
+
+
+LABEL_KINDS = ('qrcode', 'barcode')
+LABEL_CACHE_DIR = 'label_cache'
+# Part of every label hash: bump it when rendering changes so existing files are not reused
+LABEL_RENDER_VERSION = 1
+LABEL_OPTIONS = {
+    'qrcode': {},
+    'barcode': {},
+    **getattr(settings, 'LABEL_RENDER_OPTIONS', {}),
+}
+
+
+def label_hash(kind, code):
+    """sha256 of everything that determines the rendered image"""
+    payload = json.dumps([LABEL_RENDER_VERSION, kind, str(code), LABEL_OPTIONS[kind]], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def label_name(kind, code):
+    """Storage name (relative to MEDIA_ROOT) of the label image for a code"""
+    digest = label_hash(kind, code)
+    return f'{LABEL_CACHE_DIR}/{kind}/{digest[:2]}/{digest}.png'
+
+
+def label_path(kind, code):
+    return os.path.join(settings.MEDIA_ROOT, label_name(kind, code))
+
+
+def render_label(kind, code):
+    """PNG bytes of a QR code or Code39 barcode"""
+    options = LABEL_OPTIONS[kind]
+    buffer = io.BytesIO()
+    if kind == 'qrcode':
+        make(str(code), **options).save(buffer, format='PNG')
+    else:
+        Code39(str(code), writer=ImageWriter()).write(buffer, options=options or None)
+    return buffer.getvalue()
+
+
+def write_atomic(path, data):
+    """Write data to path so that readers never see a partial file"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def ensure_label(kind, code):
+    """Path of the label image for a code, rendering it on first use"""
+    path = label_path(kind, code)
+    if not os.path.exists(path):
+        write_atomic(path, render_label(kind, code))
+    return path
+
+
+def assign_label_paths(product):
+    """Point a product's qrcode_image/barcode_image at its content-addressed labels without rendering them"""
+    if product.child_code:
+        product.qrcode_image.name = label_name('qrcode', product.child_code)
+        product.barcode_image.name = label_name('barcode', product.child_code)
+
+
+def render_labels(tasks, force=False):
+    """
+    Render (kind, code) pairs into the label cache, skipping files that already exist
+    unless force is set. Imports no models, so it can run in worker processes.
+    Returns (rendered, failures) with failures as (kind, code, error) tuples.
+    """
+    rendered = 0
+    failures = []
+    for kind, code in tasks:
+        path = label_path(kind, code)
+        if not force and os.path.exists(path):
+            continue
+        try:
+            write_atomic(path, render_label(kind, code))
+        except Exception as e:
+            failures.append((kind, code, str(e)))
+        else:
+            rendered += 1
+    return rendered, failures
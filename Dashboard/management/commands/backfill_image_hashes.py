@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from Dashboard.images import image_metadata, merge_duplicate
+from Dashboard.models import Image
+
+
+class Command(BaseCommand):
+    help = 'Store content hashes, sizes and dimensions for images uploaded before they were recorded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--merge', action='store_true',
+                            help='Fold images whose bytes duplicate another image into it (links move over, the copy is deleted)')
+
+    def handle(self, *args, **options):
+        hashed = duplicates = missing = 0
+        images = Image.objects.filter(content_hash__isnull=True).order_by('id')
+        for image in images.iterator(chunk_size=500):
+            try:
+                with image.image.open('rb') as f:
+                    metadata = image_metadata(f)
+            except (OSError, ValueError):
+                missing += 1
+                self.stderr.write(f'Image {image.id}: file {image.image.name!r} cannot be read')
+                continue
+
+            original = Image.objects.filter(content_hash=metadata['content_hash']).first()
+            if original:
+                duplicates += 1
+                if options['merge']:
+                    merge_duplicate(image, original)
+                else:
+                    self.stdout.write(f'Image {image.id} duplicates image {original.id}')
+                continue
+
+            Image.objects.filter(pk=image.pk).update(**metadata)
+            hashed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Hashed {hashed} images'))
+        if duplicates:
+            action = 'merged' if options['merge'] else 'left unhashed (run with --merge to fold them)'
+            self.stdout.write(self.style.WARNING(f'{duplicates} duplicate images {action}'))
+        if missing:
+            self.stdout.write(self.style.WARNING(f'{missing} images have no readable file'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from django.utils import timezone
+from Dashboard.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Backfill denormalized Product columns (typed price/stock values, primary image and image count) for existing rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        numeric_fields = list(Product.NUMERIC_FIELDS.values())
+        batch = []
+        updated = 0
+
+        # bulk_update leaves updated_at untouched, so the backfill is not reported as a catalog change
+        products = Product.objects.only('id', *Product.NUMERIC_FIELDS.keys()).order_by('id')
+        for product in products.iterator(chunk_size=batch_size):
+            product.sync_numeric_fields()
+            batch.append(product)
+            if len(batch) >= batch_size:
+                self.flush(batch, numeric_fields)
+                updated += len(batch)
+                batch = []
+        if batch:
+            self.flush(batch, numeric_fields)
+            updated += len(batch)
+
+        # Rows without updated_at are invisible to delta sync
+        stamped = Product.objects.filter(updated_at__isnull=True, created_at__isnull=False).update(updated_at=F('created_at'))
+        stamped += Product.objects.filter(updated_at__isnull=True).update(updated_at=timezone.now())
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled denormalized fields for {updated} products'))
+        if stamped:
+            self.stdout.write(self.style.SUCCESS(f'Stamped updated_at on {stamped} products'))
+
+    def flush(self, batch, numeric_fields):
+        Product.objects.bulk_update(batch, numeric_fields)
+        Product.refresh_image_summaries([product.id for product in batch])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from Dashboard.snapshots import build_snapshot, snapshot_path
+
+
+class Command(BaseCommand):
+    help = 'Build the compressed catalog snapshot served to scanners for the current catalog version'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild even if a snapshot for this version exists')
+
+    def handle(self, *args, **options):
+        metadata = build_snapshot(force=options['force'])
+        counts = ', '.join(f'{count} {kind}s' for kind, count in metadata['counts'].items())
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot {metadata['version']} ({metadata['size']} bytes, {counts}) at {snapshot_path(metadata['version'])}"
+        ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from Dashboard.importers import copy_import_product_rows, import_product_rows, parse_product_row, product_records
+from Dashboard.ingest import IngestError, TableReader
+
+
+class Command(BaseCommand):
+    help = 'Import a product sheet (.xlsx or .csv) from the command line, e.g. for initial loads and recovery'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Product sheet with the same columns as the dashboard upload')
+        parser.add_argument('--copy', action='store_true',
+                            help='Stage rows with COPY and merge them in SQL (PostgreSQL; other databases use the ORM)')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without saving')
+
+    def handle(self, *args, **options):
+        if options['copy'] and options['dry_run']:
+            raise CommandError('--dry-run is not available with --copy; drop --copy to preview the changes')
+        load = copy_import_product_rows if options['copy'] else import_product_rows
+        try:
+            with open(options['path'], 'rb') as f, TableReader(f, options['path']) as reader:
+                rows = (parse_product_row(record) for record in product_records(reader.rows()))
+                counts = load(rows, progress=lambda seen: self.stderr.write(f'{seen} rows read'), dry_run=options['dry_run'])
+        except (OSError, IngestError) as e:
+            raise CommandError(e)
+
+        for change in counts['changes']:
+            fields = ', '.join(f'{field}: {old!r} -> {new!r}' for field, (old, new) in change['fields'].items())
+            self.stdout.write(f"{change['action']} {change['child_code']}" + (f' ({fields})' if fields else ''))
+        for error in counts['errors']:
+            self.stderr.write(self.style.WARNING(f'Skipped {error}'))
+        prefix = 'Dry run, nothing saved: ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{counts['created']} created, {counts['updated']} updated, {counts['unchanged']} unchanged"
+        ))
@@ -0,0 +1,44 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from Dashboard.filters import ProductFilter
+from Dashboard.label_sheets import LABEL_SHEET_WORKERS, LABELS_PER_PAGE, label_record, render_label_sheets
+from Dashboard.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Write printable PDF label sheets for all or filtered products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the PDF to write')
+        parser.add_argument('--filter', action='append', default=[], metavar='NAME=VALUE',
+                            help='ProductFilter parameter, e.g. --filter location=A1 --filter search_tag=Rings')
+        parser.add_argument('--workers', type=int, default=LABEL_SHEET_WORKERS)
+
+    def handle(self, *args, **options):
+        params = {}
+        for item in options['filter']:
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f'Invalid --filter {item!r}, expected NAME=VALUE')
+            params[name] = value
+        product_filter = ProductFilter(params, queryset=Product.objects.order_by('location', 'child_code', 'id'))
+        if not product_filter.is_valid():
+            raise CommandError(f'Invalid filter: {product_filter.errors.as_text()}')
+
+        started = perf_counter()
+        count = 0
+
+        def labels():
+            nonlocal count
+            for prod in product_filter.qs.only('child_code', 'parent_code', 'location').iterator(chunk_size=2000):
+                count += 1
+                yield label_record(prod)
+
+        with open(options['output'], 'wb') as f:
+            for chunk in render_label_sheets(labels(), workers=options['workers']):
+                f.write(chunk)
+
+        pages = -(-count // LABELS_PER_PAGE)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {count} labels on {pages} pages to {options['output']} in {perf_counter() - started:.1f}s"
+        ))
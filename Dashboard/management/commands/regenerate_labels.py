@@ -0,0 +1,79 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from Dashboard.filters import ProductFilter
+from Dashboard.labels import LABEL_KINDS, label_name, label_path, render_labels
+from Dashboard.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Regenerate QR code and barcode images for all or filtered products in parallel, skipping ones that are up to date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=LABEL_KINDS, action='append', help='Label type to regenerate (default: all)')
+        parser.add_argument('--filter', action='append', default=[], metavar='NAME=VALUE',
+                            help='ProductFilter parameter, e.g. --filter search=ELEC --filter search_tag=Rings')
+        parser.add_argument('--force', action='store_true', help='Re-render even if the stored image is current')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=500, help='Labels per worker task')
+
+    def handle(self, *args, **options):
+        kinds = options['kind'] or list(LABEL_KINDS)
+        params = {}
+        for item in options['filter']:
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f'Invalid --filter {item!r}, expected NAME=VALUE')
+            params[name] = value
+        product_filter = ProductFilter(params, queryset=Product.objects.order_by('id'))
+        if not product_filter.is_valid():
+            raise CommandError(f'Invalid filter: {product_filter.errors.as_text()}')
+
+        started = perf_counter()
+        tasks = set()
+        stale = []
+        skipped = 0
+        rows = product_filter.qs.values_list('id', 'child_code', 'qrcode_image', 'barcode_image')
+        for product_id, child_code, qrcode_image, barcode_image in rows.iterator(chunk_size=2000):
+            if not child_code:
+                continue
+            stored = {'qrcode': qrcode_image, 'barcode': barcode_image}
+            names = {}
+            for kind in kinds:
+                names[kind] = label_name(kind, child_code)
+                # Unchanged: the stored name already encodes this child_code and the file is on disk
+                if options['force'] or stored[kind] != names[kind] or not os.path.exists(label_path(kind, child_code)):
+                    tasks.add((kind, child_code))
+                else:
+                    skipped += 1
+            if any(stored[kind] != names[kind] for kind in kinds):
+                stale.append(Product(id=product_id, **{f'{kind}_image': names[kind] for kind in kinds}))
+
+        tasks = sorted(tasks)
+        chunk_size = max(options['chunk_size'], 1)
+        chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+        rendered = 0
+        failures = []
+        if chunks:
+            # Forked workers must not share the parent's database connection
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=max(options['workers'], 1)) as executor:
+                futures = [executor.submit(render_labels, chunk, options['force']) for chunk in chunks]
+                for future in as_completed(futures):
+                    chunk_rendered, chunk_failures = future.result()
+                    rendered += chunk_rendered
+                    failures.extend(chunk_failures)
+
+        # Labels are content-addressed, so only names that still point elsewhere need saving
+        Product.objects.bulk_update(stale, [f'{kind}_image' for kind in kinds], batch_size=1000)
+
+        elapsed = perf_counter() - started
+        rate = rendered / elapsed if elapsed else 0
+        for kind, code, error in failures[:20]:
+            self.stderr.write(f'{kind} {code!r}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {rendered} labels, skipped {skipped} up to date, {len(failures)} failed, '
+            f'updated {len(stale)} products in {elapsed:.1f}s ({rate:.0f} labels/s)'
+        ))
@@ -0,0 +1,35 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from Dashboard.jobs import JOB_HANDLERS, claim_next, requeue_stale, run_job
+
+
+class Command(BaseCommand):
+    help = 'Process queued background jobs (imports, exports); run one or more of these next to gunicorn'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', action='append', choices=sorted(JOB_HANDLERS), help='Only run jobs of this kind')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between queue checks when idle')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Requeue running jobs without a heartbeat for this many seconds')
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(seconds=options['stale_after'])
+        requeued = requeue_stale(stale_after)
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale jobs')
+
+        while True:
+            close_old_connections()
+            job = claim_next(options['kind'])
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                requeue_stale(stale_after)
+                continue
+            self.stdout.write(f'Running {job}')
+            run_job(job)
+            self.stdout.write(f'Finished {job}: {job.message}')
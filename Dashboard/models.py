@@ -1,5 +1,34 @@
-from django.db import models
+from contextvars import ContextVar
+from decimal import Decimal, InvalidOperation
+from django.db import models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
+from .labels import assign_label_paths
+
+
+def parse_decimal(value, max_digits=20, decimal_places=6):
+    """
+    Parse a free-form amount such as '1,250.5' or ' 99 ' into a Decimal, or None. The
+    value keeps every digit it was given; amounts are rounded only where they are shown.
+    """
+    if value is None:
+        return None
+    try:
+        number = Decimal(str(value).replace(',', '').strip())
+    except InvalidOperation:
+        return None
+    if not number.is_finite() or abs(number) >= 10 ** (max_digits - decimal_places):
+        return None
+    return number
+
+
+def parse_int(value):
+    """Parse a free-form quantity such as '12' or 12.0 into an int, or None"""
+    number = parse_decimal(value, max_digits=12, decimal_places=0)
+    if number is None or abs(number) > 2147483647:
+        return None
+    return int(number.to_integral_value())
+
 
 # Create your models here.
 class User(AbstractUser):
@@ -16,6 +45,19 @@ class ImageName(models.Model):
 
 class Image(models.Model):
     image = models.ImageField(upload_to='product_images/')
+    # sha256 of the file, so identical uploads are found with one indexed lookup (see images.store_image)
+    content_hash = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+class ImageAlias(models.Model):
+    """
+    A file name an image was uploaded under. Identical bytes are stored once, so a second
+    name only exists here; sheet image columns are resolved through it as well as the path.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='aliases')
 
 class Tag(models.Model):
     name = models.CharField(max_length=255)
@@ -39,6 +81,25 @@ class ProductImageLink(models.Model):
     def __str__(self):
         return f"Image {self.image.id} -> {self.parent_code}-{self.child_code}"
 
+# Set while ProductQuerySet.delete() records the tombstones itself, so the per-row signal stays quiet
+tombstones_deferred = ContextVar('tombstones_deferred', default=False)
+
+class ProductQuerySet(models.QuerySet):
+    def delete(self):
+        """Delete the products and record their tombstones with one bulk insert"""
+        with transaction.atomic():
+            deleted = list(self.values_list('id', 'parent_code', 'child_code'))
+            token = tombstones_deferred.set(True)
+            try:
+                result = super().delete()
+            finally:
+                tombstones_deferred.reset(token)
+            ProductTombstone.objects.bulk_create([
+                ProductTombstone(product_id=product_id, parent_code=parent_code, child_code=child_code)
+                for product_id, parent_code, child_code in deleted
+            ], batch_size=1000)
+        return result
+
 class Product(models.Model):
     parent_code = models.CharField(max_length=255)
     child_code = models.CharField(max_length=255)
@@ -47,6 +108,9 @@ class Product(models.Model):
     kpo = models.CharField(max_length=255, null=True, blank=True)
     images_names = models.ManyToManyField(ImageName, blank=True)
     images = models.ManyToManyField(Image, blank=True)
+    # Denormalized from images so listings need no per-row image queries; see refresh_image_summaries
+    primary_image = models.ForeignKey(Image, null=True, blank=True, on_delete=models.SET_NULL, related_name='+', editable=False)
+    image_count = models.PositiveIntegerField(default=0, editable=False)
     pairing_set = models.ManyToManyField(PairingSet, blank=True)
     qrcode_image = models.ImageField(upload_to='qrcode_images/', blank=True, null=True)
     barcode_image = models.ImageField(upload_to='barcode_images/', blank=True, null=True)
@@ -54,18 +118,89 @@ class Product(models.Model):
     thai_baht = models.CharField(max_length=255, null=True, blank=True)
     usd_rate = models.CharField(max_length=255, null=True, blank=True)
     euro_rate = models.CharField(max_length=255, null=True, blank=True)  
+    # Typed copies of the free-form price/stock text above, kept in sync on save
+    thai_baht_value = models.DecimalField(max_digits=20, decimal_places=6, null=True, blank=True, db_index=True, editable=False)
+    usd_rate_value = models.DecimalField(max_digits=20, decimal_places=6, null=True, blank=True, db_index=True, editable=False)
+    euro_rate_value = models.DecimalField(max_digits=20, decimal_places=6, null=True, blank=True, db_index=True, editable=False)
+    stock_value = models.IntegerField(null=True, blank=True, db_index=True, editable=False)
     note_1 = models.TextField(null=True, blank=True)
     note_2 = models.TextField(null=True, blank=True)
     description = models.TextField(null=True, blank=True)
     unit = models.CharField(max_length=64, null=True, blank=True)
     tag = models.ForeignKey(Tag, null=True, blank=True, on_delete=models.SET_NULL)
+    # Fingerprint of the sheet row last imported into this product; cleared by any other change
+    import_fingerprint = models.CharField(max_length=64, null=True, blank=True, editable=False)
 
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
-    
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # Composite (sort key, id) indexes back keyset pagination in product_api
+        indexes = [
+            models.Index(fields=['child_code', 'id']),
+            models.Index(fields=['parent_code', 'id']),
+            models.Index(fields=['location', 'id']),
+            models.Index(fields=['updated_at', 'id']),
+        ]
+
+    NUMERIC_FIELDS = {
+        'thai_baht': 'thai_baht_value',
+        'usd_rate': 'usd_rate_value',
+        'euro_rate': 'euro_rate_value',
+        'stock': 'stock_value',
+    }
+
+    def sync_numeric_fields(self):
+        """Refresh the typed price/stock columns from their text counterparts"""
+        self.thai_baht_value = parse_decimal(self.thai_baht)
+        self.usd_rate_value = parse_decimal(self.usd_rate)
+        self.euro_rate_value = parse_decimal(self.euro_rate)
+        self.stock_value = parse_int(self.stock)
+
+    @classmethod
+    def refresh_image_summaries(cls, product_ids):
+        """Recompute primary_image (lowest image id, as images.first()) and image_count"""
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+        summaries = {
+            row['product_id']: row
+            for row in cls.images.through.objects.filter(product_id__in=product_ids)
+            .values('product_id')
+            .annotate(count=models.Count('image_id'), first_image=models.Min('image_id'))
+        }
+        products = []
+        for product_id in product_ids:
+            summary = summaries.get(product_id)
+            products.append(cls(
+                id=product_id,
+                primary_image_id=summary['first_image'] if summary else None,
+                image_count=summary['count'] if summary else 0,
+            ))
+        cls.objects.bulk_update(products, ['primary_image', 'image_count'], batch_size=1000)
+
+    @classmethod
+    def touch(cls, product_ids):
+        """Bump updated_at for products whose related data changed without a save()"""
+        product_ids = set(product_ids)
+        if product_ids:
+            cls.objects.filter(pk__in=product_ids).update(updated_at=timezone.now(), import_fingerprint=None)
+
     def save(self, *args, **kwargs):
         """Override save to automatically link images based on persistent links"""
         is_new = self.pk is None
+        self.sync_numeric_fields()
+        assign_label_paths(self)
+        self.import_fingerprint = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'import_fingerprint'} | {
+                shadow for source, shadow in self.NUMERIC_FIELDS.items() if source in update_fields
+            }
+            if 'child_code' in update_fields:
+                kwargs['update_fields'] |= {'qrcode_image', 'barcode_image'}
         super().save(*args, **kwargs)
         
         if is_new:
@@ -78,6 +213,16 @@ class Product(models.Model):
                 if not self.images.filter(id=link.image.id).exists():
                     self.images.add(link.image)
 
+class ProductTombstone(models.Model):
+    """Record of a deleted product so syncing devices can drop it from their local catalog"""
+    product_id = models.IntegerField(db_index=True)
+    parent_code = models.CharField(max_length=255)
+    child_code = models.CharField(max_length=255)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Deleted product {self.product_id} ({self.parent_code}-{self.child_code})"
+
 class Customer(models.Model):
     name = models.CharField(max_length=255)
     locked = models.BooleanField(default=False)
@@ -124,3 +269,55 @@ class CartItem(models.Model):
     
     class Meta:
         unique_together = ('cart', 'product')
+
+class BackgroundJob(models.Model):
+    """Unit of out-of-band work (imports, exports) picked up by `manage.py run_jobs`"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    upload = models.FileField(upload_to='job_uploads/', null=True, blank=True)
+    params = models.JSONField(default=dict, blank=True)
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    rows_total = models.PositiveIntegerField(null=True, blank=True)
+    rows_done = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    message = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+        constraints = [
+            # A queued snapshot build covers whatever version is current when it runs; one is enough
+            models.UniqueConstraint(
+                fields=['kind'], condition=models.Q(kind='catalog_snapshot', status='queued'),
+                name='one_queued_catalog_snapshot',
+            ),
+        ]
+
+def _initial_version():
+    # Counters start from the clock, so a recreated row never reuses a version that
+    # still names cached pages or export files from before
+    return int(timezone.now().timestamp() * 1000)
+
+class CacheVersion(models.Model):
+    """Version counter of a cache namespace, kept in the database so every worker shares it"""
+    namespace = models.CharField(max_length=64, unique=True)
+    version = models.BigIntegerField(default=_initial_version)
+
+    def __str__(self):
+        return f"{self.namespace} v{self.version}"
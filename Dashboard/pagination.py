@@ -0,0 +1,149 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from math import ceil
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from .caching import CATALOG, make_key
+
+
+COUNT_CACHE_TIMEOUT = getattr(settings, 'PAGINATION_COUNT_CACHE_TIMEOUT', 60 * 5)
+MAX_PAGE_SIZE = getattr(settings, 'PAGINATION_MAX_PAGE_SIZE', 500)
+
+
+def cached_count(queryset):
+    """Return queryset.count(), memoized per distinct SQL statement and catalog version"""
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except Exception:
+        return queryset.count()
+    key = make_key(CATALOG, 'count', sql, repr(params))
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def paginate_queryset(queryset, page, page_size, serialize):
+    """
+    Paginate a queryset in the database (COUNT + LIMIT/OFFSET) and serialize only
+    the rows of the requested page. Returns the same shape as custom_paginate_queryset.
+    """
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+    total_items = cached_count(queryset)
+    total_pages = ceil(total_items / page_size)
+    start_index = (page - 1) * page_size
+    end_index = start_index + page_size
+    results = [serialize(obj) for obj in queryset[start_index:end_index]] if start_index < total_items else []
+
+    return {
+        'pagination': {
+            'next': page + 1 if page < total_pages else None,
+            'previous': page - 1 if page > 1 else None,
+            'count': total_items,
+            'total_pages': total_pages,
+            'current_page': page,
+        },
+        'results': results
+    }
+
+
+def encode_cursor(payload):
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode an opaque cursor, raising ValueError if it was tampered with or truncated"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(payload, dict) or not {'k', 'v', 'id', 'd'} <= payload.keys():
+        raise ValueError('Invalid cursor')
+    return payload
+
+
+def _cursor_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _after(sort_field, value, pk, descending):
+    """
+    Rows strictly after (value, pk) in an ordering of sort_field, id with
+    NULLs first when ascending and last when descending.
+    """
+    if sort_field == 'id':
+        return Q(id__lt=pk) if descending else Q(id__gt=pk)
+    if descending:
+        if value is None:
+            return Q(**{f'{sort_field}__isnull': True, 'id__lt': pk})
+        return (Q(**{f'{sort_field}__lt': value}) |
+                Q(**{sort_field: value, 'id__lt': pk}) |
+                Q(**{f'{sort_field}__isnull': True}))
+    if value is None:
+        return Q(**{f'{sort_field}__isnull': True, 'id__gt': pk}) | Q(**{f'{sort_field}__isnull': False})
+    return Q(**{f'{sort_field}__gt': value}) | Q(**{sort_field: value, 'id__gt': pk})
+
+
+def _ordering(sort_field, descending):
+    if sort_field == 'id':
+        return [F('id').desc() if descending else F('id').asc()]
+    if descending:
+        return [F(sort_field).desc(nulls_last=True), F('id').desc()]
+    return [F(sort_field).asc(nulls_first=True), F('id').asc()]
+
+
+def cursor_paginate_queryset(queryset, sort_field, descending, cursor, page_size, serialize):
+    """
+    Keyset pagination on (sort_field, id). Every page is a single indexed range scan
+    regardless of depth; next/previous positions are returned as opaque cursors.
+    """
+    page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+    sort_key = f"{sort_field}:{'desc' if descending else 'asc'}"
+    backwards = False
+    if cursor:
+        position = decode_cursor(cursor)
+        if position['k'] != sort_key:
+            raise ValueError('Cursor does not match the requested sort order')
+        backwards = position['d'] == 'prev'
+        try:
+            value = position['v']
+            if value is not None:
+                value = queryset.model._meta.get_field(sort_field).to_python(value)
+        except ValidationError as e:
+            raise ValueError('Invalid cursor') from e
+        # Paging backwards is paging forwards over the reversed ordering
+        queryset = queryset.filter(_after(sort_field, value, position['id'], descending != backwards))
+
+    rows = list(queryset.order_by(*_ordering(sort_field, descending != backwards))[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    def position_of(obj, direction):
+        return encode_cursor({'k': sort_key, 'v': _cursor_value(getattr(obj, sort_field)), 'id': obj.pk, 'd': direction})
+
+    # A backwards page was reached from a later page, a forwards page from an earlier one
+    has_next = True if backwards else has_more
+    has_previous = has_more if backwards else bool(cursor)
+    return {
+        'pagination': {
+            'next_cursor': position_of(rows[-1], 'next') if rows and has_next else None,
+            'previous_cursor': position_of(rows[0], 'prev') if rows and has_previous else None,
+            'page_size': page_size,
+        },
+        'results': [serialize(obj) for obj in rows]
+    }
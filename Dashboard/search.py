@@ -0,0 +1,57 @@
+import logging
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# Columns matched by the dashboard free-text search box
+SEARCH_FIELDS = ['parent_code', 'child_code', 'location', 'kpo', 'stock']
+
+
+def free_search_q(value):
+    """
+    Build the free-text search predicate. Accepts either a plain term matched against
+    every search field, or the combined "PARENT - CHILD" form shown in the dashboard.
+    """
+    if ' - ' in value:
+        parent_part, child_part = value.split(' - ', 1)
+        return Q(parent_code__icontains=parent_part.strip()) & Q(child_code__icontains=child_part.strip())
+
+    query = Q()
+    for field in SEARCH_FIELDS:
+        query |= Q(**{f'{field}__icontains': value})
+    return query
+
+
+def create_trigram_indexes(using='default'):
+    """
+    Create pg_trgm GIN indexes matching the expression Django emits for icontains on
+    PostgreSQL (UPPER(col::text) LIKE UPPER(...)), so substring searches are served from
+    the index instead of a sequential scan. Other databases keep plain LIKE scans.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return False
+
+    quote = connection.ops.quote_name
+    table = Product._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for field in SEARCH_FIELDS:
+                column = Product._meta.get_field(field).column
+                index_name = f'{table}_{column}_trgm'.lower()
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {quote(index_name)} ON {quote(table)} '
+                    f'USING gin ((UPPER({quote(column)}::text)) gin_trgm_ops)'
+                )
+    except DatabaseError as e:
+        logger.warning('Could not create trigram search indexes: %s', e)
+        return False
+    return True
+
+
+def create_search_indexes(sender, using='default', **kwargs):
+    """post_migrate handler"""
+    create_trigram_indexes(using=using)
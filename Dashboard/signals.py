@@ -0,0 +1,93 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from .caching import CARTS, CUSTOMERS, bump_catalog_version, bump_version
+from .models import Cart, CartItem, Customer, Image, PairingSet, Product, ProductTombstone, Tag, tombstones_deferred
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=PairingSet)
+@receiver(post_delete, sender=PairingSet)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Image)
+def catalog_changed(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    if tombstones_deferred.get():
+        return
+    ProductTombstone.objects.create(
+        product_id=instance.pk,
+        parent_code=instance.parent_code,
+        child_code=instance.child_code,
+    )
+
+
+@receiver(m2m_changed, sender=Product.pairing_set.through)
+@receiver(m2m_changed, sender=Product.images.through)
+def product_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep primary_image/image_count, updated_at and the catalog version in step with Product's relations"""
+    if reverse and action == 'pre_clear':
+        # image.product_set.clear(): remember who loses the relation before the rows go
+        instance._cleared_product_ids = list(instance.product_set.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        product_ids = [instance.pk]
+    elif action == 'post_clear':
+        product_ids = getattr(instance, '_cleared_product_ids', [])
+    else:
+        product_ids = pk_set or []
+    if sender is Product.images.through:
+        Product.refresh_image_summaries(product_ids)
+    Product.touch(product_ids)
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=PairingSet)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Image)
+def related_saved(sender, instance, created, **kwargs):
+    # A renamed tag or pairing set, or a replaced image file, changes every product showing it
+    if not created:
+        Product.touch(instance.product_set.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=PairingSet)
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Image)
+def related_deleting(sender, instance, **kwargs):
+    # Cascaded through rows and SET_NULL updates send no signals of their own
+    instance._linked_product_ids = list(instance.product_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=PairingSet)
+@receiver(post_delete, sender=Tag)
+def related_deleted(sender, instance, **kwargs):
+    Product.touch(getattr(instance, '_linked_product_ids', []))
+
+
+@receiver(post_delete, sender=Image)
+def image_deleted(sender, instance, **kwargs):
+    if getattr(instance, '_linked_product_ids', None):
+        Product.refresh_image_summaries(instance._linked_product_ids)
+        Product.touch(instance._linked_product_ids)
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def customer_changed(sender, **kwargs):
+    bump_version(CUSTOMERS)
+
+
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def cart_changed(sender, **kwargs):
+    bump_version(CARTS)
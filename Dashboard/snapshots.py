@@ -0,0 +1,187 @@
+import fcntl
+import glob
+import gzip
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .caching import get_catalog_version
+from .jobs import enqueue, job_handler
+from .models import BackgroundJob, PairingSet, Product, Tag
+from .sync import current_watermark
+
+
+SNAPSHOT_DIR = getattr(settings, 'CATALOG_SNAPSHOT_DIR', os.path.join(settings.BASE_DIR, 'snapshots'))
+SNAPSHOT_KEEP = getattr(settings, 'CATALOG_SNAPSHOT_KEEP', 2)
+SNAPSHOT_CHUNK_SIZE = 2000
+
+
+def snapshot_path(version):
+    return os.path.join(SNAPSHOT_DIR, f'catalog-{version}.ndjson.gz')
+
+
+def metadata_path(version):
+    return os.path.join(SNAPSHOT_DIR, f'catalog-{version}.json')
+
+
+def read_metadata(version):
+    """Metadata of the snapshot built for a catalog version, or None if there is none yet"""
+    try:
+        with open(metadata_path(version)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_metadata(version):
+    """Metadata of a complete snapshot for a catalog version, or None"""
+    return read_metadata(version) if os.path.exists(snapshot_path(version)) else None
+
+
+def latest_snapshot():
+    """Metadata of the most recently built snapshot still on disk, whatever its version, or None"""
+    snapshots = sorted(glob.glob(os.path.join(SNAPSHOT_DIR, 'catalog-*.ndjson.gz')), key=os.path.getmtime, reverse=True)
+    for path in snapshots:
+        metadata = read_metadata(os.path.basename(path)[len('catalog-'):-len('.ndjson.gz')])
+        if metadata:
+            return metadata
+    return None
+
+
+def schedule_snapshot(version, user=None):
+    """
+    A background build that will cover a catalog version, enqueuing one if there is none.
+    Queued builds snapshot whatever version is current when they run, so any will do; the
+    one_queued_catalog_snapshot constraint keeps concurrent requests from queuing two.
+    """
+    pending = BackgroundJob.objects.filter(
+        Q(status=BackgroundJob.QUEUED) | Q(status=BackgroundJob.RUNNING, params__version=version),
+        kind='catalog_snapshot',
+    )
+    job = pending.first()
+    if job is not None:
+        return job
+    try:
+        with transaction.atomic():
+            return enqueue('catalog_snapshot', params={'version': version}, user=user)
+    except IntegrityError:
+        # Another request queued one in the meantime
+        return pending.first()
+
+
+@contextmanager
+def _build_lock():
+    # One build at a time across workers; the others wait and then find the finished file
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    with open(os.path.join(SNAPSHOT_DIR, '.build.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _records():
+    yield from ({'type': 'tag', 'id': tag.id, 'name': tag.name} for tag in Tag.objects.order_by('id'))
+    yield from (
+        {'type': 'pairing_set', 'id': pairing.id, 'value': pairing.pair_value}
+        for pairing in PairingSet.objects.order_by('id')
+    )
+    products = (
+        Product.objects.select_related('primary_image')
+        .prefetch_related('pairing_set')
+        .order_by('id')
+    )
+    for prod in products.iterator(chunk_size=SNAPSHOT_CHUNK_SIZE):
+        yield {
+            'type': 'product',
+            'id': prod.id,
+            'parent_code': prod.parent_code,
+            'child_code': prod.child_code,
+            'location': prod.location,
+            'stock': prod.stock,
+            'kpo': prod.kpo,
+            'weight': str(prod.weight),
+            'thai_baht': prod.thai_baht,
+            'usd_rate': prod.usd_rate,
+            'euro_rate': prod.euro_rate,
+            'note_1': prod.note_1,
+            'note_2': prod.note_2,
+            'description': prod.description,
+            'unit': prod.unit,
+            'tag_id': prod.tag_id,
+            'pairing_set': [pairing.id for pairing in prod.pairing_set.all()],
+            'image': prod.primary_image.image.url if prod.primary_image else None,
+            'image_count': prod.image_count,
+            'updated_at': prod.updated_at.isoformat() if prod.updated_at else None,
+        }
+
+
+def build_snapshot(force=False):
+    """
+    Write the gzip-compressed NDJSON snapshot for the current catalog version unless
+    it already exists, and return its metadata. The first line is a header carrying
+    the version and a delta-sync watermark taken before any row was read, so clients
+    can continue from the snapshot with /api/products/sync/. Builds hold a file lock,
+    so concurrent callers wait for the running build instead of starting their own.
+    """
+    version = get_catalog_version()
+    metadata = None if force else snapshot_metadata(version)
+    if metadata:
+        return metadata
+    with _build_lock():
+        metadata = None if force else snapshot_metadata(version)
+        return metadata or _build(version)
+
+
+def _build(version):
+    path = snapshot_path(version)
+    header = {
+        'type': 'header',
+        'version': version,
+        'watermark': current_watermark(),
+        'generated_at': timezone.now().isoformat(),
+    }
+    metadata = dict(header, counts={'tag': 0, 'pairing_set': 0, 'product': 0})
+    del metadata['type']
+    fd, tmp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as out:
+            out.write(json.dumps(header).encode() + b'\n')
+            for record in _records():
+                metadata['counts'][record['type']] += 1
+                out.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+        metadata['size'] = os.path.getsize(tmp_path)
+        with open(metadata_path(version), 'w') as f:
+            json.dump(metadata, f)
+        # Readers only ever see complete files, and only once their metadata exists
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    _prune(keep=path)
+    return metadata
+
+
+def _prune(keep):
+    """Remove all but the SNAPSHOT_KEEP most recent snapshots"""
+    snapshots = sorted(glob.glob(os.path.join(SNAPSHOT_DIR, 'catalog-*.ndjson.gz')), key=os.path.getmtime, reverse=True)
+    for path in snapshots[SNAPSHOT_KEEP:]:
+        if path == keep:
+            continue
+        for stale in (path, path[:-len('.ndjson.gz')] + '.json'):
+            try:
+                os.unlink(stale)
+            except OSError:
+                pass
+
+
+@job_handler('catalog_snapshot')
+def run_snapshot_build(job, progress):
+    metadata = build_snapshot()
+    return dict(metadata, message=f"Catalog snapshot {metadata['version']} ready")
@@ -0,0 +1,123 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Product, ProductTombstone
+from .pagination import decode_cursor, encode_cursor
+
+
+SYNC_BATCH_SIZE = getattr(settings, 'SYNC_BATCH_SIZE', 500)
+SYNC_MAX_BATCH_SIZE = getattr(settings, 'SYNC_MAX_BATCH_SIZE', 2000)
+# Rows newer than this are held back a little so a transaction that stamped
+# updated_at earlier but committed later is not skipped by the watermark
+SYNC_SETTLE_SECONDS = getattr(settings, 'SYNC_SETTLE_SECONDS', 5)
+
+
+def encode_watermark(updated_at, product_id, tombstone_id):
+    return encode_cursor({
+        'k': 'sync',
+        'v': updated_at.isoformat() if updated_at else None,
+        'id': product_id,
+        'd': tombstone_id,
+    })
+
+
+def decode_watermark(token):
+    """Decode a sync watermark into (updated_at, product_id, tombstone_id), raising ValueError if invalid"""
+    position = decode_cursor(token)
+    if position['k'] != 'sync' or not isinstance(position['id'], int) or not isinstance(position['d'], int):
+        raise ValueError('Invalid watermark')
+    updated_at = None
+    if position['v'] is not None:
+        try:
+            updated_at = parse_datetime(position['v'])
+        except (TypeError, ValueError, ValidationError):
+            updated_at = None
+        if updated_at is None:
+            raise ValueError('Invalid watermark')
+    return updated_at, position['id'], position['d']
+
+
+def current_watermark():
+    """Watermark covering every settled product and tombstone, for clients bootstrapped from a snapshot"""
+    horizon = timezone.now() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    last = (
+        Product.objects.filter(updated_at__lte=horizon)
+        .order_by('-updated_at', '-id')
+        .values_list('updated_at', 'id')
+        .first()
+    )
+    tombstone_id = ProductTombstone.objects.filter(deleted_at__lte=horizon).aggregate(last=Max('id'))['last'] or 0
+    updated_at, product_id = last or (None, 0)
+    return encode_watermark(updated_at, product_id, tombstone_id)
+
+
+def serialize_product(prod):
+    """Compact product record for device catalogs; media URLs are relative"""
+    return {
+        'id': prod.id,
+        'parent_code': prod.parent_code,
+        'child_code': prod.child_code,
+        'location': prod.location,
+        'stock': prod.stock,
+        'kpo': prod.kpo,
+        'pairing_set': [{'id': pairing.id, 'value': pairing.pair_value} for pairing in prod.pairing_set.all()],
+        'weight': str(prod.weight),
+        'thai_baht': prod.thai_baht,
+        'usd_rate': prod.usd_rate,
+        'euro_rate': prod.euro_rate,
+        'note_1': prod.note_1,
+        'note_2': prod.note_2,
+        'description': prod.description,
+        'unit': prod.unit,
+        'tag': prod.tag.name if prod.tag else '',
+        'images': [{'url': image.image.url} for image in prod.images.all()],
+        'updated_at': prod.updated_at.isoformat() if prod.updated_at else None,
+    }
+
+
+def changes_since(watermark, limit=SYNC_BATCH_SIZE):
+    """
+    Products changed and products deleted after a watermark, at most `limit` of each,
+    ordered on (updated_at, id) and tombstone id. Without a watermark every product is
+    returned and the tombstones that already exist are skipped.
+    """
+    limit = min(max(limit, 1), SYNC_MAX_BATCH_SIZE)
+    horizon = timezone.now() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+
+    if watermark:
+        updated_at, product_id, tombstone_id = decode_watermark(watermark)
+    else:
+        updated_at, product_id = None, 0
+        tombstone_id = ProductTombstone.objects.aggregate(last=Max('id'))['last'] or 0
+
+    products = Product.objects.filter(updated_at__lte=horizon)
+    if updated_at is not None:
+        products = products.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=product_id))
+    products = list(
+        products.select_related('tag')
+        .prefetch_related('pairing_set', 'images')
+        .order_by('updated_at', 'id')[:limit + 1]
+    )
+    tombstones = list(
+        ProductTombstone.objects.filter(id__gt=tombstone_id, deleted_at__lte=horizon)
+        .order_by('id')
+        .values_list('id', 'product_id')[:limit + 1]
+    )
+
+    has_more = len(products) > limit or len(tombstones) > limit
+    products = products[:limit]
+    tombstones = tombstones[:limit]
+    if products:
+        updated_at, product_id = products[-1].updated_at, products[-1].id
+    if tombstones:
+        tombstone_id = tombstones[-1][0]
+
+    return {
+        'products': [serialize_product(prod) for prod in products],
+        'deleted': [deleted_product_id for _, deleted_product_id in tombstones],
+        'watermark': encode_watermark(updated_at, product_id, tombstone_id),
+        'has_more': has_more,
+    }
@@ -1,3 +1,481 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import Workbook
+from PIL import Image as PILImage
+from . import caching, exports, ingest, label_sheets, snapshots, sync, views
+from .catalog import CodeIndex
+from .downloads import file_download
+from .importers import copy_import_product_rows, import_product_rows, parse_product_row, product_records, read_pairing_values
+from .ingest import MemoryCeilingExceeded, MissingColumnsError, TableReader, iter_records
+from .pagination import decode_cursor, encode_cursor
+from .models import BackgroundJob, Cart, Customer, Image, ImageAlias, PairingSet, Product, ProductImageLink, User
 
-# Create your tests here.
+
+def csv_file(text, bom=False):
+    return io.BytesIO(('\ufeff' if bom else '').encode() + text.encode())
+
+
+def xlsx_file(rows):
+    workbook = Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    f = io.BytesIO()
+    workbook.save(f)
+    f.seek(0)
+    return f
+
+
+def read(file, name):
+    with TableReader(file, name) as reader:
+        return list(reader.rows())
+
+
+class TableReaderTests(SimpleTestCase):
+    rows = [('Parent Code', 'Child Code', 'Location'), ('P1', 'C1', 'Shelf A'), ('P2', 'C2', 'Shelf B')]
+
+    def test_csv_with_bom_reads_like_xlsx(self):
+        text = ''.join(','.join(row) + '\n' for row in self.rows)
+        self.assertEqual(read(csv_file(text, bom=True), 'sheet.csv'), self.rows)
+        self.assertEqual(read(csv_file(text, bom=True), 'sheet.csv'), read(xlsx_file(self.rows), 'sheet.xlsx'))
+
+    def test_bom_does_not_hide_the_first_header(self):
+        text = 'Parent Code,Child Code,Location,Qty,Weight,Thai Baht,USD,EUR,Note 1,Note 2\nP1,C1,L,1,2,3,4,5,a,b\n'
+        with TableReader(csv_file(text, bom=True), 'sheet.csv') as reader:
+            record = next(product_records(reader.rows()))
+        self.assertEqual(record['parent_code'], 'P1')
+
+    def test_blank_cells_are_none(self):
+        self.assertEqual(read(csv_file('a, ,c\n,,\n'), 'sheet.csv'), [('a', None, 'c'), (None, None, None)])
+        self.assertEqual(read(xlsx_file([('a', None, 'c')]), 'sheet.xlsx'), [('a', None, 'c')])
+
+    def test_blank_and_short_rows_fill_missing_columns_with_none(self):
+        rows = [('code', 'qty', 'note'), (), None, ('C1',), ('C2', '3')]
+        records = list(iter_records(rows, {'code': ['code'], 'qty': ['qty'], 'note': ['note']}))
+        self.assertEqual(records, [
+            {'code': None, 'qty': None, 'note': None},
+            {'code': None, 'qty': None, 'note': None},
+            {'code': 'C1', 'qty': None, 'note': None},
+            {'code': 'C2', 'qty': '3', 'note': None},
+        ])
+
+    def test_memory_ceiling_stops_the_read(self):
+        text = 'a\n' * 10
+        with mock.patch.object(ingest, 'INGEST_MAX_RSS_MB', 100), \
+                mock.patch.object(ingest, 'MEMORY_CHECK_INTERVAL', 4), \
+                mock.patch.object(ingest, 'current_rss_mb', return_value=150):
+            with TableReader(csv_file(text), 'sheet.csv') as reader:
+                rows = reader.rows()
+                self.assertEqual(len([next(rows) for _ in range(3)]), 3)
+                with self.assertRaisesMessage(MemoryCeilingExceeded, 'row 4'):
+                    next(rows)
+
+    def test_memory_ceiling_below_limit_or_disabled(self):
+        text = 'a\n' * 10
+        with mock.patch.object(ingest, 'MEMORY_CHECK_INTERVAL', 4), \
+                mock.patch.object(ingest, 'current_rss_mb', return_value=150):
+            with mock.patch.object(ingest, 'INGEST_MAX_RSS_MB', 200):
+                self.assertEqual(len(read(csv_file(text), 'sheet.csv')), 10)
+            with mock.patch.object(ingest, 'INGEST_MAX_RSS_MB', None):
+                self.assertEqual(len(read(csv_file(text), 'sheet.csv')), 10)
+
+
+class ProductRecordsTests(SimpleTestCase):
+    def test_header_aliases(self):
+        header = ('CHILD_CODE', 'parent code', 'Location', 'Quantity', 'Weight', 'THB', 'USD Dollar', 'eur',
+                  'note_1', 'Note 2', 'Tag', 'Image Names', 'Product Description')
+        row = ('C1', 'P1', 'L', '5', '1.5', '100', '3', '2', 'n1', 'n2', 'Rings', 'a.png', 'Gold ring')
+        record = next(product_records([header, row]))
+        self.assertEqual(record, dict(
+            record, parent_code='P1', child_code='C1', location='L', stock='5', weight='1.5', thai_baht='100',
+            usd_rate='3', euro_rate='2', note_1='n1', note_2='n2', category='Rings', images_names='a.png',
+            description='Gold ring', kpo=None, unit=None, pairing_set=None,
+        ))
+
+    def test_missing_required_column(self):
+        with self.assertRaises(MissingColumnsError):
+            next(product_records([('Parent Code', 'Child Code'), ('P1', 'C1')]))
+
+
+class PairingValuesTests(SimpleTestCase):
+    def test_first_column_without_header(self):
+        rows = read(csv_file('SET1,ignored\n\n  SET2 \n,x\nSET1\n'), 'sheet.csv')
+        self.assertEqual(read_pairing_values(rows), ['SET1', 'SET2', 'SET1'])
+
+    def test_xlsx_numbers_become_text(self):
+        rows = read(xlsx_file([(101,), (None,), ('SET3',)]), 'sheet.xlsx')
+        self.assertEqual(read_pairing_values(rows), ['101', 'SET3'])
+
+
+class CartImportTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('staff', password='pw'))
+        self.customer = Customer.objects.create(name='Customer')
+        Product.objects.create(parent_code='P1', child_code='C1', location='L')
+        Product.objects.create(parent_code='P2', child_code='C2', location='L')
+
+    def upload(self, file, name):
+        url = reverse('import_customer_cart_excel', args=[self.customer.id])
+        return self.client.post(url, {'file': SimpleUploadedFile(name, file.getvalue())}).json()
+
+    def quantities(self):
+        cart = Cart.objects.get(customer=self.customer, is_active=True)
+        return dict(cart.items.values_list('product__child_code', 'quantity'))
+
+    def test_header_aliases_in_any_order(self):
+        result = self.upload(csv_file('Qty,Product Code\n2,C1\n,C2\n3,MISSING\n', bom=True), 'cart.csv')
+        self.assertTrue(result['success'])
+        self.assertEqual(self.quantities(), {'C1': 2, 'C2': 1})
+
+    def test_without_header_code_then_quantity(self):
+        result = self.upload(xlsx_file([('P1-C1', 4), (None, None), ('C2',)]), 'cart.xlsx')
+        self.assertTrue(result['success'])
+        self.assertEqual(self.quantities(), {'C1': 4, 'C2': 1})
+
+
+PRODUCT_HEADER = 'Parent Code,Child Code,Location,Qty,KPO,Pairing Set,Weight,Thai Baht,USD,EUR,Note 1,Note 2,Category\n'
+
+
+def product_rows(text):
+    with TableReader(csv_file(PRODUCT_HEADER + text), 'products.csv') as reader:
+        return [parse_product_row(record) for record in product_records(reader.rows())]
+
+
+class ProductImportTests(TestCase):
+    sheet = 'P,C1,L,1,,A,1,100,,,,,Rings\nP,C2,L,2,,,1,100,,,,,\nP,C3,L,3,,,1,100,,,,,\n'
+
+    def test_create_update_then_unchanged(self):
+        seen = []
+        created = import_product_rows(product_rows(self.sheet), chunk_size=2, progress=seen.append)
+        self.assertEqual((created['created'], created['updated'], created['unchanged']), (3, 0, 0))
+        self.assertEqual([c['action'] for c in created['changes']], ['create'] * 3)
+        self.assertEqual(seen[-1], 3)
+
+        changed = import_product_rows(product_rows(self.sheet.replace('P,C2,L,2,,,1,100', 'P,C2,L,2,,,1,200')), chunk_size=2)
+        self.assertEqual((changed['created'], changed['updated'], changed['unchanged']), (0, 1, 2))
+        self.assertEqual(changed['changes'], [{'child_code': 'C2', 'action': 'update', 'fields': {'thai_baht': ['100', '200']}}])
+        self.assertEqual(Product.objects.get(child_code='C2').thai_baht, '200')
+
+        again = import_product_rows(product_rows(self.sheet.replace('P,C2,L,2,,,1,100', 'P,C2,L,2,,,1,200')), chunk_size=2)
+        self.assertEqual((again['created'], again['updated'], again['unchanged'], again['changes']), (0, 0, 3, []))
+
+    def test_dry_run_leaves_the_database_untouched(self):
+        import_product_rows(product_rows(self.sheet))
+        before = list(Product.objects.order_by('id').values_list('child_code', 'location', 'updated_at', 'import_fingerprint'))
+
+        report = import_product_rows(product_rows(self.sheet.replace('P,C1,L,', 'P,C1,MOVED,') + 'P,C4,L,1,,,1,1,,,,,\n'), dry_run=True)
+        self.assertEqual((report['created'], report['updated'], report['unchanged']), (1, 1, 2))
+        self.assertIn({'child_code': 'C1', 'action': 'update', 'fields': {'location': ['L', 'MOVED']}}, report['changes'])
+        self.assertEqual(list(Product.objects.order_by('id').values_list('child_code', 'location', 'updated_at', 'import_fingerprint')), before)
+
+    def test_bad_row_is_reported_without_failing_its_chunk(self):
+        report = import_product_rows(product_rows('P,C1,L,1,,,1,1,,,,,\nP,C2,,1,,,1,1,,,,,\nP,C3,L,1,,,123456,1,,,,,\nP,C4,L,1,,,1,1,,,,,\n'))
+        self.assertEqual(report['errors'], ['Row 3 (C2): location is missing', 'Row 4 (C3): weight 123456 is out of range'])
+        self.assertEqual(report['created'], 2)
+        self.assertEqual(sorted(Product.objects.values_list('child_code', flat=True)), ['C1', 'C4'])
+
+    def test_repeated_code_across_chunks_is_merged(self):
+        sheet = 'P,IC001,L1,1,,A,1,100,,,,,Rings\n'
+        sheet += ''.join(f'P,IC{i:03},L,1,,,1,100,,,,,\n' for i in range(2, 51))
+        sheet += 'P2,IC001,L9,2,,,1,100,,,,,\n'
+
+        first = import_product_rows(product_rows(sheet), chunk_size=20)
+        self.assertEqual((first['created'], first['updated']), (50, 0))
+        self.assertEqual([c['child_code'] for c in first['changes']].count('IC001'), 1)
+        product = Product.objects.get(child_code='IC001')
+        self.assertEqual((product.parent_code, product.location, product.stock), ('P', 'L9', '2'))
+        self.assertEqual(product.tag.name, 'Rings')
+        self.assertEqual(list(product.pairing_set.values_list('pair_value', flat=True)), ['A'])
+
+        updated_at = product.updated_at
+        again = import_product_rows(product_rows(sheet), chunk_size=20)
+        self.assertEqual((again['created'], again['updated'], again['unchanged']), (0, 0, 50))
+        self.assertEqual(again['changes'], [])
+        self.assertEqual(Product.objects.get(child_code='IC001').updated_at, updated_at)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('staff', password='pw'))
+        # Prices repeat out of id order so pages split runs of equal sort keys
+        prices = {Product.objects.create(parent_code='P', child_code=f'C{i}', location='L', thai_baht=str(100 * (i % 3))).id: i % 3
+                  for i in range(7)}
+        self.ascending = sorted(prices, key=lambda pk: (prices[pk], pk))
+        self.descending = sorted(prices, key=lambda pk: (-prices[pk], -pk))
+
+    def page(self, cursor='', **params):
+        response = self.client.get(reverse('product_api'), dict({'sort_by': 'price', 'sort_order': 'asc', 'page_size': 2, 'cursor': cursor}, **params))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return [row['id'] for row in data['results']], data['pagination']
+
+    def test_equal_sort_keys_are_paged_in_a_stable_order(self):
+        ids, pagination = self.page()
+        self.assertIsNone(pagination['previous_cursor'])
+        pages = [ids]
+        while pagination['next_cursor']:
+            ids, pagination = self.page(pagination['next_cursor'])
+            pages.append(ids)
+        self.assertEqual([len(ids) for ids in pages], [2, 2, 2, 1])
+        self.assertEqual(sum(pages, []), self.ascending)
+
+        descending = []
+        cursor = ''
+        while cursor is not None:
+            ids, pagination = self.page(cursor, sort_order='desc')
+            descending += ids
+            cursor = pagination['next_cursor']
+        self.assertEqual(descending, self.descending)
+
+    def test_direction_flag_pages_backwards(self):
+        first, pagination = self.page()
+        second, pagination = self.page(pagination['next_cursor'])
+        self.assertEqual(decode_cursor(pagination['previous_cursor'])['d'], 'prev')
+        ids, back = self.page(pagination['previous_cursor'])
+        self.assertEqual(ids, first)
+        self.assertIsNone(back['previous_cursor'])
+        self.assertIsNotNone(back['next_cursor'])
+
+        # The same position read forwards continues after it instead
+        position = dict(decode_cursor(pagination['previous_cursor']), d='next')
+        ids, _ = self.page(encode_cursor(position))
+        self.assertEqual(ids, self.ascending[3:5])
+
+    def test_tampered_or_garbage_cursor_is_rejected(self):
+        _, pagination = self.page()
+        position = decode_cursor(pagination['next_cursor'])
+        for cursor in ['not a cursor', pagination['next_cursor'][:-3], encode_cursor([1, 2]),
+                       encode_cursor({'k': position['k'], 'v': position['v']}),
+                       encode_cursor(dict(position, k='id:asc')),
+                       encode_cursor(dict(position, v='cheap'))]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('product_api'), {'sort_by': 'price', 'sort_order': 'asc', 'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+
+class SingleProductTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(views, 'code_index', CodeIndex(max_entries=100))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        pairing = PairingSet.objects.create(pair_value='A')
+        self.product = Product.objects.create(parent_code='P', child_code='C1', location='L')
+        neighbour = Product.objects.create(parent_code='P', child_code='C2', location='L')
+        self.product.pairing_set.add(pairing)
+        neighbour.pairing_set.add(pairing)
+        caching.get_version(caching.CATALOG)
+
+    def test_repeat_scan_reads_the_catalog_version_once(self):
+        first = self.client.get(reverse('single_product'), {'code': 'C1'})
+        self.assertEqual([item['code'] for item in first.json()['matching_items']], ['C2'])
+        with self.assertNumQueries(1):
+            again = self.client.get(reverse('single_product'), {'code': 'C1'})
+        self.assertEqual(again.json(), first.json())
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('single_product'), {'code': 'C1'}, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+    def test_catalog_change_is_served_after_the_version_moves(self):
+        self.client.get(reverse('single_product'), {'code': 'C1'})
+        Product.objects.filter(id=self.product.id).update(location='MOVED')
+        # What the committed write's bump does
+        caching._increment(caching.CATALOG)
+        self.assertEqual(self.client.get(reverse('single_product'), {'code': 'C1'}).json()['location'], 'MOVED')
+
+
+class LabelSheetTests(TestCase):
+    def test_sheets_are_composed_without_a_process_pool(self):
+        Product.objects.bulk_create([
+            Product(parent_code='P', child_code=f'C{i}', location='L')
+            for i in range(label_sheets.LABELS_PER_PAGE * label_sheets.PARALLEL_MIN_PAGES + 1)
+        ])
+        self.client.force_login(User.objects.create_user('staff', password='pw'))
+        with mock.patch.object(label_sheets, 'ProcessPoolExecutor', side_effect=AssertionError('pool started')):
+            response = self.client.get(reverse('label_sheets'))
+            pdf = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        self.assertIn(f'/Count {label_sheets.PARALLEL_MIN_PAGES + 1}'.encode(), pdf)
+
+
+class PairingSetExportTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = mock.patch.object(exports, 'EXPORT_CACHE_DIR', directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        PairingSet.objects.create(pair_value='A')
+        self.client.force_login(User.objects.create_user('staff', password='pw'))
+
+    def test_export_form_post_is_sent_to_the_get_route(self):
+        response = self.client.post(reverse('pairing_set'), {'method_type': 'export', 'format': 'csv'})
+        self.assertRedirects(response, reverse('pairing_set_export') + '?format=csv', fetch_redirect_response=False)
+
+    def test_export_revalidates_with_its_etag(self):
+        first = self.client.get(reverse('pairing_set_export'), {'format': 'xlsx'})
+        self.assertEqual(first.status_code, 200)
+        b''.join(first.streaming_content)
+        again = self.client.get(reverse('pairing_set_export'), {'format': 'xlsx'}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(self.client.post(reverse('pairing_set_export')).status_code, 405)
+
+    def test_conditional_headers_are_ignored_on_unsafe_methods(self):
+        path = os.path.join(exports.EXPORT_CACHE_DIR, 'file.bin')
+        with open(path, 'wb') as f:
+            f.write(b'0123456789')
+        request = RequestFactory().post('/', HTTP_IF_NONE_MATCH='"tag"', HTTP_RANGE='bytes=0-3')
+        response = file_download(request, path, 'application/octet-stream', 'tag')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+
+class BulkImageUploadTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(MEDIA_ROOT=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_login(User.objects.create_user('staff', password='pw'))
+
+    def test_same_bytes_under_two_names_are_stored_once_and_linked_twice(self):
+        first = Product.objects.create(parent_code='P', child_code='RING1', location='L')
+        second = Product.objects.create(parent_code='P', child_code='RING2', location='L')
+        png = io.BytesIO()
+        PILImage.new('RGB', (2, 2), 'red').save(png, format='PNG')
+
+        for name in ('RING1.png', 'RING2.png'):
+            response = self.client.post(reverse('upload_bulk_images'), {'file': SimpleUploadedFile(name, png.getvalue(), 'image/png')})
+            self.assertEqual(response.json()['results'][0]['linked_products'], [f'P-{name[:-4]}'])
+        image = Image.objects.get()
+        self.assertEqual(sorted(image.aliases.values_list('name', flat=True)), ['RING1.png', 'RING2.png'])
+        self.assertEqual(sorted(image.product_set.values_list('child_code', flat=True)), ['RING1', 'RING2'])
+        self.assertEqual(ProductImageLink.objects.filter(image=image).count(), 2)
+
+        first.delete()
+        second.refresh_from_db()
+        self.assertEqual(list(second.images.all()), [image])
+        self.assertEqual((second.image_count, second.primary_image_id), (1, image.id))
+        self.assertTrue(os.path.exists(image.image.path))
+
+
+class SyncTests(TestCase):
+    def pull(self, since=None, later=0):
+        """changes_since as seen `later` seconds from now"""
+        now = timezone.now() + timedelta(seconds=later)
+        with mock.patch.object(sync.timezone, 'now', return_value=now):
+            return sync.changes_since(since)
+
+    def test_rows_inside_the_settle_window_arrive_on_the_next_pull(self):
+        settled = Product.objects.create(parent_code='P', child_code='C1', location='L')
+        Product.objects.filter(id=settled.id).update(updated_at=timezone.now() - timedelta(minutes=1))
+        # Stamped before the next pull's watermark moves past it, as a late commit would be
+        recent = Product.objects.create(parent_code='P', child_code='C2', location='L')
+
+        first = self.pull()
+        self.assertEqual([prod['id'] for prod in first['products']], [settled.id])
+        self.assertEqual(self.pull(first['watermark'])['products'], [])
+
+        second = self.pull(first['watermark'], later=sync.SYNC_SETTLE_SECONDS + 1)
+        self.assertEqual([prod['id'] for prod in second['products']], [recent.id])
+        self.assertEqual(self.pull(second['watermark'], later=sync.SYNC_SETTLE_SECONDS + 1)['products'], [])
+
+    def test_bulk_deletes_are_reported_as_tombstones(self):
+        products = [Product.objects.create(parent_code='P', child_code=f'C{i}', location='L') for i in range(3)]
+        start = self.pull(later=sync.SYNC_SETTLE_SECONDS + 1)
+        self.assertEqual(len(start['products']), 3)
+
+        Product.objects.filter(id__in=[products[0].id, products[1].id]).delete()
+        self.assertEqual(self.pull(start['watermark'])['deleted'], [])
+        changes = self.pull(start['watermark'], later=sync.SYNC_SETTLE_SECONDS + 1)
+        self.assertEqual(sorted(changes['deleted']), [products[0].id, products[1].id])
+        self.assertEqual(changes['products'], [])
+        self.assertEqual(self.pull(changes['watermark'], later=sync.SYNC_SETTLE_SECONDS + 1)['deleted'], [])
+        # A fresh device starts from the live catalog and skips existing tombstones
+        self.assertEqual(self.pull(later=sync.SYNC_SETTLE_SECONDS + 1)['deleted'], [])
+
+    def test_garbage_watermark_is_rejected(self):
+        response = self.client.get(reverse('product_sync_api'), {'since': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'The COPY importer stages rows in PostgreSQL temporary tables')
+class CopyImportTests(TestCase):
+    def test_insert_update_and_relink(self):
+        stored = Image.objects.create(image='product_images/c1.png')
+        aliased = Image.objects.create(image='product_images/other.png')
+        ImageAlias.objects.create(name='alias.png', image=aliased)
+        existing = Product.objects.create(parent_code='P', child_code='C1', location='OLD')
+        existing.pairing_set.add(PairingSet.objects.create(pair_value='A'))
+        existing.images.add(aliased)
+
+        header = 'Parent Code,Child Code,Location,Qty,Pairing Set,Weight,Thai Baht,USD,EUR,Note 1,Note 2,Category,Images,Description\n'
+        sheet = (
+            'P,C1,NEW,5,B,1,"1,250.5",,,,,Rings,c1.png,\n'
+            'P2,C2,L,1,"A,B",1,10,,,,,,alias.png,First\n'
+            'P3,C2,L2,2,,1,20,,,,,,,\n'
+        )
+        with TableReader(csv_file(header + sheet), 'products.csv') as reader:
+            counts = copy_import_product_rows(parse_product_row(record) for record in product_records(reader.rows()))
+        self.assertEqual((counts['created'], counts['updated'], counts['errors']), (1, 1, []))
+
+        existing.refresh_from_db()
+        self.assertEqual((existing.location, existing.stock, existing.tag.name), ('NEW', '5', 'Rings'))
+        self.assertEqual(existing.thai_baht_value, Decimal('1250.5'))
+        self.assertEqual(list(existing.pairing_set.values_list('pair_value', flat=True)), ['B'])
+        self.assertEqual(list(existing.images.values_list('id', flat=True)), [stored.id])
+        self.assertEqual((existing.image_count, existing.primary_image_id), (1, stored.id))
+
+        created = Product.objects.get(child_code='C2')
+        self.assertEqual((created.parent_code, created.location, created.description), ('P2', 'L2', 'First'))
+        self.assertEqual(sorted(created.pairing_set.values_list('pair_value', flat=True)), ['A', 'B'])
+        self.assertEqual(list(created.images.values_list('id', flat=True)), [aliased.id])
+        self.assertEqual(created.image_count, 1)
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = mock.patch.object(snapshots, 'SNAPSHOT_DIR', directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        Product.objects.create(parent_code='P', child_code='C1', location='L')
+
+    def test_one_queued_build_at_a_time(self):
+        first = snapshots.schedule_snapshot('1')
+        self.assertEqual(snapshots.schedule_snapshot('2'), first)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BackgroundJob.objects.create(kind='catalog_snapshot')
+        self.assertEqual(BackgroundJob.objects.filter(kind='catalog_snapshot').count(), 1)
+
+    def test_previous_snapshot_served_while_rebuilding(self):
+        first = snapshots.build_snapshot()
+        # What the next committed catalog change does
+        caching._increment(caching.CATALOG)
+        response = self.client.get(reverse('catalog_snapshot_api'))
+        self.assertEqual(response['ETag'], f'"{first["version"]}"')
+        response.close()
+        self.assertEqual(BackgroundJob.objects.filter(kind='catalog_snapshot', status=BackgroundJob.QUEUED).count(), 1)
+
+    def test_pruned_snapshot_falls_back_to_the_newest(self):
+        current = snapshots.build_snapshot()
+        gone = dict(current, version='pruned')
+        with mock.patch('Dashboard.views.snapshot_metadata', return_value=None), \
+                mock.patch('Dashboard.views.latest_snapshot', side_effect=[gone, current]):
+            response = self.client.get(reverse('catalog_snapshot_api'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{current["version"]}"')
+        response.close()
@@ -6,6 +6,9 @@ urlpatterns = [
 
     path('single_product/',views.single_product, name='single_product'),
     path('product_api/',views.product_api, name='product_api'),
+    path('api/products/sync/', views.product_sync_api, name='product_sync_api'),
+    path('api/catalog/snapshot/', views.catalog_snapshot_api, name='catalog_snapshot_api'),
+    path('api/catalog/snapshot/meta/', views.catalog_snapshot_meta_api, name='catalog_snapshot_meta_api'),
 
     path('login/',views.login_view, name='login'),
     path('user_logout/', views.user_logout, name='user_logout'),
@@ -13,7 +16,10 @@ urlpatterns = [
     path('export_excel/', views.export_to_excel, name='export_excel'),
     path('export_selected_to_excel/', views.export_selected_to_excel, name='export_selected_to_excel'),
     path('pairing_set/',views.pairing_set_view, name='pairing_set'),
+    path('pairing_set/export/',views.pairing_set_export, name='pairing_set_export'),
     path('pairing_set_print/',views.pairing_set_print_view, name='pairing_set_print'),
+    path('label_sheets/', views.label_sheets_pdf, name='label_sheets'),
+    path('api/jobs/<int:job_id>/', views.job_status_api, name='job_status_api'),
     path('pairing_set_api/',views.pairing_set_api, name='pairing_set_api'),
     path('upload_bulk_images/',views.upload_bulk_images, name='upload_bulk_images'),
     path('image_management/', views.image_management, name='image_management'),
@@ -21,6 +27,7 @@ urlpatterns = [
     path('get_unlinked_images/', views.get_unlinked_images, name='get_unlinked_images'),
     path('search_products_for_linking/', views.search_products_for_linking, name='search_products_for_linking'),
     path('api/product/<int:product_id>/images/', views.product_images_api, name='product_images_api'),
+    path('api/product/<int:product_id>/label/<str:kind>/', views.label_image, name='label_image'),
     
     # Cart Management URLs
     path('cart-management/', views.cart_management_view, name='cart_management'),
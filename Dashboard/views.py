@@ -4,7 +4,7 @@ from .models import *
 import uuid
 import os
 from openpyxl import Workbook
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
@@ -20,6 +20,19 @@ from time import time
 from qrcode import make
 from barcode import Code39
 from .filters import *
+from .pagination import paginate_queryset, cursor_paginate_queryset
+from .catalog import code_index
+from .sync import changes_since
+from .snapshots import build_snapshot, latest_snapshot, schedule_snapshot, snapshot_metadata, snapshot_path
+from .downloads import file_download
+from .labels import LABEL_KINDS, ensure_label, label_hash
+from .label_sheets import label_record, render_label_sheets
+from .importers import product_records
+from .ingest import MissingColumnsError, TableReader, iter_records
+from .jobs import enqueue, job_status
+from .images import store_image
+from .exports import EXPORT_CHUNK_SIZE, PRODUCT_EXPORT_COLUMNS, cached_export_response, export_cart_items, export_products, product_export_row, xlsx_response
+from .caching import CARTS, CATALOG, CUSTOMERS, bump_catalog_version, get_catalog_version, make_key, versioned_cache_page, versioned_etag
 import json
 from barcode.writer import ImageWriter
 from django.conf import settings
@@ -28,6 +41,9 @@ import io
 from django.views.decorators.cache import cache_page
 from django.core.cache import cache
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.urls import reverse
+from urllib.parse import urlencode
 from django.utils import timezone
 
 
@@ -45,48 +61,40 @@ def upload_bulk_images(request):
         
         for uploaded_image in uploaded_images:
             try:
-                # Check if image already exists
-                image, created = Image.objects.get_or_create(
-                    defaults={'image': uploaded_image},
-                    image__icontains=uploaded_image.name.split('.')[0]
-                )
+                # Same bytes already uploaded (under any name)?
+                image, created = store_image(uploaded_image)
                 
                 if created:
                     uploaded_count += 1
-                    # Try to link with products based on image name
-                    image_name_without_ext = uploaded_image.name.split('.')[0]
-                    products = Product.objects.filter(
-                        Q(parent_code__icontains=image_name_without_ext) |
-                        Q(child_code__icontains=image_name_without_ext)
-                    )
-                    
-                    linked_products = []
-                    for product in products:
-                        if not product.images.filter(id=image.id).exists():
-                            product.images.add(image)
-                            product.save()
-                            
-                            # Create persistent link
-                            ProductImageLink.objects.get_or_create(
-                                image=image,
-                                parent_code=product.parent_code,
-                                child_code=product.child_code
-                            )
-                            
-                            linked_products.append(f"{product.parent_code}-{product.child_code}")
-                            linked_count += 1
-                    
-                    results.append({
-                        'name': uploaded_image.name,
-                        'status': 'uploaded',
-                        'linked_products': linked_products
-                    })
-                else:
-                    results.append({
-                        'name': uploaded_image.name,
-                        'status': 'already_exists',
-                        'linked_products': []
-                    })
+                # Link products matching the uploaded name, even when the bytes were already stored under another name
+                image_name_without_ext = uploaded_image.name.split('.')[0]
+                products = Product.objects.filter(
+                    Q(parent_code__icontains=image_name_without_ext) |
+                    Q(child_code__icontains=image_name_without_ext)
+                )
+                
+                linked_products = []
+                for product in products:
+                    if not product.images.filter(id=image.id).exists():
+                        # The m2m signal refreshes the image summary and updated_at; saving
+                        # this stale instance afterwards would overwrite them
+                        product.images.add(image)
+                        
+                        # Create persistent link
+                        ProductImageLink.objects.get_or_create(
+                            image=image,
+                            parent_code=product.parent_code,
+                            child_code=product.child_code
+                        )
+                        
+                        linked_products.append(f"{product.parent_code}-{product.child_code}")
+                        linked_count += 1
+                
+                results.append({
+                    'name': uploaded_image.name,
+                    'status': 'uploaded' if created else 'already_exists',
+                    'linked_products': linked_products
+                })
             except Exception as e:
                 results.append({
                     'name': uploaded_image.name,
@@ -239,14 +247,7 @@ def form_view(request):
                 messages.error(request,"Select at least one image!")
                 return redirect('form')    
             for uploaded_image in uploaded_images:
-                # Check if image already exists by filename
-                existing_image = Image.objects.filter(image__icontains=uploaded_image.name).first()
-                if existing_image:
-                    image = existing_image
-                    created = False
-                else:
-                    image = Image.objects.create(image=uploaded_image)
-                    created = True
+                image, created = store_image(uploaded_image)
                 
                 products = Product.objects.all()
                 for product in products:
@@ -258,135 +259,33 @@ def form_view(request):
         if type == 'bulk-create':
             try:
                 xlsx_file = request.FILES.get("xlsx_file")
-                if not (xlsx_file.name.endswith('.xlsx') or xlsx_file.name.endswith('.xls')):
+                if not xlsx_file.name.lower().endswith(('.xlsx', '.xls', '.csv')):
                     messages.error(request,'File is not xlsx type')
                     return redirect("form")
 
-                wb = load_workbook(xlsx_file, data_only=True)
-                sheet = wb.active
-                header_values = [str(c.value).strip().lower() if c.value is not None else '' for c in sheet[1]]
-                def find_idx(candidates):
-                    for name in candidates:
-                        if name in header_values:
-                            return header_values.index(name)
-                    return None
-                idx_parent = find_idx(['parent code','parent_code'])
-                idx_child = find_idx(['child code','child_code'])
-                idx_location = find_idx(['location'])
-                idx_stock = find_idx(['qty','stock','quantity'])
-                idx_kpo = find_idx(['kpo'])
-                idx_pairing = find_idx(['pairing set','pairing_set','pairing sets'])
-                idx_weight = find_idx(['weight'])
-                idx_thai_baht = find_idx(['thai baht','thai_baht','thb'])
-                idx_usd_rate = find_idx(['usd rate','usd_rate','usd dollar','usd'])
-                idx_euro_rate = find_idx(['euro rate','euro_rate','eur'])
-                idx_note1 = find_idx(['note 1','note_1'])
-                idx_note2 = find_idx(['note 2','note_2'])
-                idx_category = find_idx(['category','tag'])
-                idx_unit = find_idx(['unit'])
-                idx_description = find_idx(['product description','description'])
-                idx_images_names = find_idx(['images','image names','images names','image_names'])
-                required_indices = [idx_parent, idx_child, idx_location, idx_stock, idx_weight, idx_thai_baht, idx_usd_rate, idx_euro_rate, idx_note1, idx_note2]
-                if any(i is None for i in required_indices):
-                    messages.error(request,'Missing required columns in Excel header')
-                    return redirect("form")
-                for fields in sheet.iter_rows(min_row=2, values_only=True):
-                    if not fields or (idx_parent is not None and not fields[idx_parent]):
-                        continue
-                    parent_code = fields[idx_parent]
-                    child_code = fields[idx_child]
-                    location = fields[idx_location]
-                    stock = fields[idx_stock]
-                    kpo = fields[idx_kpo] if idx_kpo is not None else None
-                    pairing_sets_data = None
-                    if idx_pairing is not None and fields[idx_pairing]:
-                        pairing_sets_data = str(fields[idx_pairing]).split(',')
+                # Check the header up front so a bad file is reported right away, then import out of band
+                with TableReader(xlsx_file) as reader:
                     try:
-                        weight = Decimal(str(fields[idx_weight])) if fields[idx_weight] is not None else Decimal('0.00')
-                    except (ValueError, TypeError):
-                        weight = Decimal('0.00')
-                    thai_baht = fields[idx_thai_baht]
-                    usd_rate = fields[idx_usd_rate]
-                    euro_rate = fields[idx_euro_rate]
-                    note_1 = fields[idx_note1]
-                    note_2 = fields[idx_note2]
-                    description = fields[idx_description] if idx_description is not None else None
-                    unit = fields[idx_unit] if idx_unit is not None else None
-                    category_name = fields[idx_category] if idx_category is not None else None
-                    images_names_data = None
-                    if idx_images_names is not None and len(fields) > idx_images_names and fields[idx_images_names]:
-                        images_names_data = str(fields[idx_images_names]).split(',')
-                    product =  Product.objects.filter(child_code=child_code).first()
-                    if product:
-                        product.location = location
-                        product.stock = stock
-                        product.kpo = kpo
-                        product.weight = weight
-                        product.thai_baht = thai_baht
-                        product.usd_rate = usd_rate
-                        product.euro_rate = euro_rate
-                        product.note_1 = note_1
-                        product.note_2 = note_2
-                        if description is not None:
-                            product.description = description
-                        if unit is not None:
-                            product.unit = unit
-                        if category_name:
-                            tag_obj, _ = Tag.objects.get_or_create(name=str(category_name).strip())
-                            product.tag = tag_obj
-                        product.save()
-                    else:      
-                        product = Product.objects.create(parent_code=parent_code, child_code=child_code, location=location, stock=stock, kpo=kpo, weight=weight, thai_baht=thai_baht, usd_rate=usd_rate, euro_rate=euro_rate, note_1=note_1, note_2=note_2, description=description or None, unit=unit or None)
-                        if category_name:
-                            try:
-                                tag_obj, _ = Tag.objects.get_or_create(name=str(category_name).strip())
-                                product.tag = tag_obj
-                                product.save()
-                            except Exception:
-                                pass
-                    pairing_sets = []
-                    if pairing_sets_data:
-                        for pair_value in pairing_sets_data:
-                            pairing_set_obj, created = PairingSet.objects.get_or_create(pair_value=str(pair_value).strip())
-                            pairing_sets.append(pairing_set_obj)
-                        product.pairing_set.set(pairing_sets)
-                    if images_names_data:
-                        images_names = []
-                        for image_name in images_names_data:
-                            image_name_obj, created = ImageName.objects.get_or_create(name=str(image_name).strip())
-                            images_names.append(image_name_obj)
-                        product.images_names.set(images_names)
-                        image_files = Image.objects.filter(image__in=[f'product_images/{img_name.name}' for img_name in images_names])
-                        product.images.set(image_files)
-                        product.save()
+                        next(product_records(reader.rows()), None)
+                    except MissingColumnsError as e:
+                        messages.error(request, str(e))
+                        return redirect("form")
+                xlsx_file.seek(0)
+                job = enqueue('product_import', upload=xlsx_file, params={'dry_run': bool(request.POST.get('dry_run'))}, user=request.user)
 
-                    qr_img = make(child_code)
-                    qr_img_name = f'{str(time())}.png'
-                    buffer = io.BytesIO()
-                    qr_img.save(buffer, format='PNG')
-                    buffer.seek(0)
-                    product.qrcode_image.save(qr_img_name, ImageFile(buffer), save=True)
-
-                    barcode_obj = Code39(child_code, writer=ImageWriter())
-                    buffer = io.BytesIO()
-                    barcode_obj.write(buffer)
-                    buffer.seek(0)
-                    product.barcode_image.save(f'{child_code}.png', ImageFile(buffer), save=True)
-                
-                    product.save()
-                    
             except Exception as e:
                 messages.error(request, f"Error processing Excel file: {str(e)}. Please check your file format and data.")
                 return redirect('form')
-                
-            messages.success(request,"Successfully saved data from file!")
-            return redirect('form')
+
+            messages.info(request, "File uploaded, importing in the background.")
+            return redirect(f"{reverse('form')}?job={job.id}")
         
         if type == 'product-grouping':
             tag = data.get('tag')
             products_ids = request.POST.getlist('products')
             tag_obj, created = Tag.objects.get_or_create(name=tag)
-            products = Product.objects.filter(id__in=products_ids).update(tag=tag_obj)
+            products = Product.objects.filter(id__in=products_ids).update(tag=tag_obj, updated_at=timezone.now(), import_fingerprint=None)
+            bump_catalog_version()  # queryset.update() sends no save signals
             messages.success(request,"Successfully Grouping!")
             return redirect('form')
 
@@ -425,26 +324,10 @@ def form_view(request):
 
             if uploaded_images:
                 for uploaded_image in uploaded_images:
-                    image, created = Image.objects.get_or_create(image__exact=uploaded_image.name)
-                    if created:
-                        image.image = uploaded_image
-                        image.save()
+                    image, created = store_image(uploaded_image)
                     product.images.add(image)
                     product.save()
 
-            qr_img = make(child_code)
-            qr_img_name = f'{str(time())}.png'
-            buffer = io.BytesIO()
-            qr_img.save(buffer, format='PNG')
-            buffer.seek(0)
-            product.qrcode_image.save(qr_img_name, ImageFile(buffer), save=True)
-
-            barcode_obj = Code39(child_code, writer=ImageWriter())
-            buffer = io.BytesIO()
-            barcode_obj.write(buffer)
-            buffer.seek(0)
-            product.barcode_image.save(f'{child_code}.png', ImageFile(buffer), save=True)
-
             product.save()
             messages.success(request,"Successfully Created!")
             return redirect('form')
@@ -499,26 +382,10 @@ def form_view(request):
             uploaded_images = request.FILES.getlist("images")
             if uploaded_images:
                 for uploaded_image in uploaded_images:
-                    image, created = Image.objects.get_or_create(image__exact=uploaded_image.name)
-                    if created:
-                        image.image = uploaded_image
-                        image.save()
+                    image, created = store_image(uploaded_image)
                     product.images.add(image)
                     product.save()
 
-            qr_img = make(child_code)
-            qr_img_name = f'{str(time())}.png'
-            buffer = io.BytesIO()
-            qr_img.save(buffer, format='PNG')
-            buffer.seek(0)
-            product.qrcode_image.save(qr_img_name, ImageFile(buffer), save=True)
-
-            barcode_obj = Code39(child_code, writer=ImageWriter())
-            buffer = io.BytesIO()
-            barcode_obj.write(buffer)
-            buffer.seek(0)
-            product.barcode_image.save(f'{child_code}.png', ImageFile(buffer), save=True)
-            
             product.save()
             messages.success(request,"Successfully Updated!")
             return redirect('form')
@@ -574,6 +441,7 @@ def form_view(request):
         })
 
 @login_required
+@versioned_cache_page()
 def product_api(request):
     # Handle sorting
     sort_by = request.GET.get('sort_by', 'id')
@@ -585,9 +453,11 @@ def product_api(request):
         'child_code': 'child_code',
         'location': 'location',
         'kpo': 'kpo',
-        'price': 'thai_baht',
-        'stock': 'stock',
+        'price': 'thai_baht_value',
+        'stock': 'stock_value',
         'weight': 'weight',
+        'updated_at': 'updated_at',
+        'created_at': 'created_at',
         'id': 'id'
     }
     
@@ -600,33 +470,53 @@ def product_api(request):
     else:
         order_by = actual_sort_field
     
-    product_obj = Product.objects.prefetch_related('images_names', 'images', 'pairing_set').order_by(order_by)
+    # Secondary ordering on id keeps LIMIT/OFFSET pages stable for duplicate sort values
+    ordering = [order_by] if actual_sort_field == 'id' else [order_by, '-id']
+    product_obj = Product.objects.select_related('tag', 'primary_image').prefetch_related('pairing_set').order_by(*ordering)
     product_obj = ProductFilter(request.GET, queryset=product_obj)
-    data = [{
-        'id': pro_obj.id,
-        'image':pro_obj.images.first().image.url if pro_obj.images.exists() else '',
-        'parent_code':pro_obj.parent_code,
-        'child_code':pro_obj.child_code,
-        'location':pro_obj.location,
-        'stock':pro_obj.stock,
-        'kpo':pro_obj.kpo,
-        'weight':pro_obj.weight,
-        'thai_baht':pro_obj.thai_baht,
-        'usd_rate':pro_obj.usd_rate,
-        'euro_rate':pro_obj.euro_rate,
-        'note_1': pro_obj.note_1,
-        'note_2': pro_obj.note_2,
-        'description': pro_obj.description,
-        'unit': pro_obj.unit,
-        'tag':pro_obj.tag.name if pro_obj.tag else '',
-        'pairing_set':[ps.id for ps in pro_obj.pairing_set.all()],
-        'image_count': pro_obj.images.count()
-    } for pro_obj in product_obj.qs]
-
-    data = custom_paginate_queryset(
-        queryset=data,
+
+    def serialize(pro_obj):
+        return {
+            'id': pro_obj.id,
+            'image':pro_obj.primary_image.image.url if pro_obj.primary_image else '',
+            'parent_code':pro_obj.parent_code,
+            'child_code':pro_obj.child_code,
+            'location':pro_obj.location,
+            'stock':pro_obj.stock,
+            'kpo':pro_obj.kpo,
+            'weight':pro_obj.weight,
+            'thai_baht':pro_obj.thai_baht,
+            'usd_rate':pro_obj.usd_rate,
+            'euro_rate':pro_obj.euro_rate,
+            'note_1': pro_obj.note_1,
+            'note_2': pro_obj.note_2,
+            'description': pro_obj.description,
+            'unit': pro_obj.unit,
+            'tag':pro_obj.tag.name if pro_obj.tag else '',
+            'pairing_set':[ps.id for ps in pro_obj.pairing_set.all()],
+            'image_count': pro_obj.image_count
+        }
+
+    # Opt-in keyset pagination: ?cursor= (empty for the first page) pages on the sort key
+    if 'cursor' in request.GET:
+        try:
+            data = cursor_paginate_queryset(
+                queryset=product_obj.qs,
+                sort_field=actual_sort_field,
+                descending=sort_order == 'desc',
+                cursor=request.GET.get('cursor'),
+                page_size=int(request.GET.get('page_size', 10)),
+                serialize=serialize
+            )
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return JsonResponse(data, safe=False)
+
+    data = paginate_queryset(
+        queryset=product_obj.qs,
         page=int(request.GET.get('page', 1)),
-        page_size=int(request.GET.get('page_size', 10))
+        page_size=int(request.GET.get('page_size', 10)),
+        serialize=serialize
     )
     return JsonResponse(data, safe=False)
 
@@ -637,67 +527,35 @@ def product_detail(request, id):
     prod = Product.objects.get(id=id)
     return render(request, 'product_detail.html', {'prod' : prod})
 
-# @cache_page(60 * 60 * 24)  # Cache for one day (24 hours)
 @csrf_exempt
+@condition(etag_func=versioned_etag(CATALOG))
 def single_product(request):
     if request.method == 'GET':
         # Support multiple search parameters
         child_code = request.GET.get('child_code')
         parent_code = request.GET.get('parent_code')
         code = request.GET.get('code')  # Generic code parameter for QR/barcode scanning
+        # Read once by the ETag check; the code index is the response cache here
+        version = request.cache_versions[CATALOG]
         
         # If generic 'code' parameter is provided, search in both child_code and parent_code
         if code:
-            prod = Product.objects.prefetch_related('pairing_set', 'images').filter(
-                Q(child_code=code) | Q(parent_code=code)
-            ).first()
+            prod_data = code_index.lookup('code', code, version)
         elif child_code:
-            prod = Product.objects.prefetch_related('pairing_set', 'images').filter(child_code=child_code).first()
+            prod_data = code_index.lookup('child_code', child_code, version)
         elif parent_code:
-            prod = Product.objects.prefetch_related('pairing_set', 'images').filter(parent_code=parent_code).first()
+            prod_data = code_index.lookup('parent_code', parent_code, version)
         else:
             return JsonResponse({'error': 'Please provide code, child_code, or parent_code parameter'}, status=400)
             
-        if prod:
-            # Get matching items (pairing set products)
-            matching_items = []
-            for pairing in prod.pairing_set.all():
-                matching_products = Product.objects.prefetch_related('images').filter(
-                    pairing_set__pair_value=pairing.pair_value
-                ).exclude(id=prod.id)[:5]  # Limit to 5 matching items
-                
-                for matching_prod in matching_products:
-                    matching_items.append({
-                        'code': matching_prod.child_code,
-                        'parent_code': matching_prod.parent_code,
-                        'image_url': matching_prod.images.first().image.url if matching_prod.images.exists() else None
-                    })
-            
-            prod_data = {
-                'success': True,
-                'id': prod.id,
-                'parent_code': prod.parent_code,
-                'child_code': prod.child_code,
-                'location': prod.location,
-                'stock': prod.stock,
-                'kpo': prod.kpo,
-                'pairing_set': [{'value': pairing.pair_value} for pairing in prod.pairing_set.all()],
-                'weight': str(prod.weight),
-                'thai_baht': prod.thai_baht,
-                'usd_rate': prod.usd_rate,
-                'euro_rate': prod.euro_rate,
-                'note_1': prod.note_1,
-                'note_2': prod.note_2,
-                'description': prod.description,
-                'unit': prod.unit,
-                'tag': prod.tag.name if prod.tag else '',
-                'images': [{'url': request.build_absolute_uri(image.image.url)} for image in prod.images.all()],
-                'qrcode_image': request.build_absolute_uri(prod.qrcode_image.url) if prod.qrcode_image else None,
-                'barcode_image': request.build_absolute_uri(prod.barcode_image.url) if prod.barcode_image else None,
-                'matching_items': matching_items,
-                'created_at': prod.created_at.isoformat() if prod.created_at else None,
-                'updated_at': prod.updated_at.isoformat() if prod.updated_at else None,
-            }
+        if prod_data:
+            # Cached payloads are shared, so build absolute URLs on a copy
+            prod_data = dict(
+                prod_data,
+                images=[{'url': request.build_absolute_uri(image['url'])} for image in prod_data['images']],
+                qrcode_image=request.build_absolute_uri(prod_data['qrcode_image']) if prod_data['qrcode_image'] else None,
+                barcode_image=request.build_absolute_uri(prod_data['barcode_image']) if prod_data['barcode_image'] else None,
+            )
             return JsonResponse(prod_data, safe=False)
         else:
             return JsonResponse({
@@ -706,6 +564,94 @@ def single_product(request):
                 'error': 'No product found with the provided code'
             }, status=404)
     return JsonResponse({'error': 'Only GET requests are allowed'}, status=405)
+
+@csrf_exempt
+def product_sync_api(request):
+    """Delta sync for device catalogs: pass back the returned watermark as ?since= until has_more is false"""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET requests are allowed'}, status=405)
+    try:
+        limit = int(request.GET.get('limit', 500))
+        data = changes_since(request.GET.get('since'), limit)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    for prod_data in data['products']:
+        prod_data['images'] = [{'url': request.build_absolute_uri(image['url'])} for image in prod_data['images']]
+    return JsonResponse(data)
+
+def label_image(request, kind, product_id):
+    """QR code or barcode PNG for a product, rendered on first request and cached on disk"""
+    if kind not in LABEL_KINDS:
+        return JsonResponse({'error': 'Unknown label type'}, status=404)
+    child_code = Product.objects.filter(id=product_id).values_list('child_code', flat=True).first()
+    if not child_code:
+        return JsonResponse({'error': 'Product not found'}, status=404)
+    try:
+        path = ensure_label(kind, child_code)
+    except Exception as e:
+        return JsonResponse({'error': f'Cannot encode {child_code!r}: {e}'}, status=400)
+    response = file_download(request, path, 'image/png', label_hash(kind, child_code))
+    # Same URL, new image when child_code changes: revalidate every time, a 304 is cheap
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+@login_required
+def label_sheets_pdf(request):
+    """Printable label sheets (PDF) for the products matching the ProductFilter parameters"""
+    product_filter = ProductFilter(request.GET, queryset=Product.objects.order_by('location', 'child_code', 'id'))
+    products = product_filter.qs.only('child_code', 'parent_code', 'location')
+    if not products.exists():
+        return JsonResponse({'error': 'No products match the filter'}, status=404)
+    labels = (label_record(prod) for prod in products.iterator(chunk_size=2000))
+    # Composed in this process: large runs belong to the print_label_sheets command
+    response = StreamingHttpResponse(render_label_sheets(labels), content_type='application/pdf')
+    response['Content-Disposition'] = 'inline; filename="labels.pdf"'
+    return response
+
+@login_required
+def job_status_api(request, job_id):
+    """Progress of a background job, polled by the dashboard"""
+    job = get_object_or_404(BackgroundJob, id=job_id)
+    return JsonResponse(job_status(job))
+
+@csrf_exempt
+def catalog_snapshot_api(request):
+    """
+    Gzip NDJSON catalog snapshot. While the snapshot for the current catalog version is
+    being built by a background job, the previous one is served; its watermark lets the
+    client catch up through the sync API. Only the very first snapshot is built in the request.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse({'error': 'Only GET requests are allowed'}, status=405)
+    version = get_catalog_version()
+    metadata = snapshot_metadata(version)
+    if metadata is None:
+        metadata = latest_snapshot()
+        if metadata is None:
+            metadata = build_snapshot()
+        else:
+            schedule_snapshot(version)
+    try:
+        return _snapshot_download(request, metadata['version'])
+    except FileNotFoundError:
+        # A finished build pruned the snapshot we picked; serve whichever is newest now
+        metadata = latest_snapshot() or build_snapshot()
+        return _snapshot_download(request, metadata['version'])
+
+def _snapshot_download(request, version):
+    return file_download(request, snapshot_path(version), 'application/gzip', version, filename=f'catalog-{version}.ndjson.gz')
+
+@csrf_exempt
+def catalog_snapshot_meta_api(request):
+    """Cheap version check: clients download the snapshot only when the version differs from theirs"""
+    version = get_catalog_version()
+    metadata = snapshot_metadata(version)
+    return JsonResponse({
+        **(metadata or {}),
+        'version': version,
+        'ready': metadata is not None,
+        'url': request.build_absolute_uri(reverse('catalog_snapshot_api')),
+    })
     
 def login_view(request):
     if request.user.is_authenticated:
@@ -749,63 +695,9 @@ def user_logout(request):
             messages.warning(request, 'Request is not responed please check your internet connection and try again!')
             return redirect('form')
 
-def custom_paginate_queryset(queryset, page, page_size):
-    total_items = len(queryset)
-    total_pages = ceil(total_items / page_size)
-    start_index = (page - 1) * page_size
-    end_index = start_index + page_size
-    paginated_queryset = queryset[start_index:end_index]
-    
-    return {
-        'pagination': {
-            'next': page + 1 if page < total_pages else None,
-            'previous': page - 1 if page > 1 else None,
-            'count': total_items,
-            'total_pages': total_pages,
-            'current_page': page,
-        },
-        'results': paginated_queryset
-    }
-
 
 def export_to_excel(request):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Karen Data'
-
-    columns = ['Parent Code', 'Child Code', 'Location', 'QTY', 'kpo', 'pairing_set', 'weight', 'thai_baht', 'usd_rate', 'euro_rate', 'Category', 'Unit', 'Product Description', 'Note 1', 'Note 2', 'Image Count']
-    ws.append(columns)
-
-    product = Product.objects.prefetch_related('pairing_set', 'images').order_by('-id')
-
-    for prod in product:
-        pairing_set_values = ', '.join([ps.pair_value for ps in prod.pairing_set.all()]) if prod.pairing_set.exists() else None
-        ws.append([
-            prod.parent_code,
-            prod.child_code,
-            prod.location,  
-            prod.stock,
-            prod.kpo,
-            pairing_set_values,
-            prod.weight,
-            prod.thai_baht,
-            prod.usd_rate,
-            prod.euro_rate,
-            (prod.tag.name if getattr(prod, 'tag', None) else ''),
-            (prod.unit or ''),
-            (prod.description or ''),
-            prod.note_1,
-            prod.note_2,
-            prod.images.count(),
-        ])
-
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    response['Content-Disposition'] = 'attachment; filename=karen_report.xlsx'
-    wb.save(response)
-
-    return response
+    return cached_export_response(request, 'products', 'karen_report')
 
 
 def export_selected_to_excel(request):
@@ -814,57 +706,24 @@ def export_selected_to_excel(request):
         if not selected_ids:
             return JsonResponse({'success': False, 'error': 'No products selected.'}, status=400)
 
-        wb = Workbook()
-        ws = wb.active
-        ws.title = 'Selected Products'
-
-        columns = ['Parent Code', 'Child Code', 'Location', 'QTY', 'kpo', 'pairing_set', 'weight', 'thai_baht', 'usd_rate', 'euro_rate', 'Category', 'Unit', 'Product Description', 'Note 1', 'Note 2', 'Image Count']
-        ws.append(columns)
-
-        products = Product.objects.filter(id__in=selected_ids).prefetch_related('pairing_set', 'images')
-
-        for prod in products:
-            pairing_set_values = ', '.join([ps.pair_value for ps in prod.pairing_set.all()]) if prod.pairing_set.exists() else None
-            ws.append([
-                prod.parent_code,
-                prod.child_code,
-                prod.location,
-                prod.stock,
-                prod.kpo,
-                pairing_set_values,
-                prod.weight,
-                prod.thai_baht,
-                prod.usd_rate,
-                prod.euro_rate,
-                (prod.tag.name if getattr(prod, 'tag', None) else ''),
-                (prod.unit or ''),
-                (prod.description or ''),
-                prod.note_1,
-                prod.note_2,
-                prod.images.count(),
-            ])
-
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = 'attachment; filename=selected_products.xlsx'
-        wb.save(response)
-
-        return response
+        products = export_products(Product.objects.filter(id__in=selected_ids))
+        rows = (product_export_row(prod) for prod in products.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+        return xlsx_response('selected_products.xlsx', 'Selected Products', PRODUCT_EXPORT_COLUMNS, rows)
 
     return JsonResponse({'success': False, 'error': 'Invalid request method.'}, status=405)
 
 
 @login_required
+@versioned_cache_page()
 def pairing_set_api(request):
     pair_objs = PairingSet.objects.all().order_by('-id')
     pair_objs = ProductFilter(request.GET, queryset=pair_objs)
-    data = [{'id': pair_obj.id, 'name': pair_obj.pair_value} for pair_obj in pair_objs.qs]
 
-    data = custom_paginate_queryset(
-        queryset=data,
+    data = paginate_queryset(
+        queryset=pair_objs.qs,
         page=int(request.GET.get('page', 1)),
-        page_size=int(request.GET.get('page_size', 10))
+        page_size=int(request.GET.get('page_size', 10)),
+        serialize=lambda pair_obj: {'id': pair_obj.id, 'name': pair_obj.pair_value}
     )
     return JsonResponse(data, safe=False)
 
@@ -889,10 +748,9 @@ def image_api(request):
             images = images.filter(product__isnull=True)
         
         # Prepare image data
-        image_data = []
-        for image in images:
+        def serialize(image):
             linked_products = image.product_set.all()
-            image_data.append({
+            return {
                 'id': image.id,
                 'alt_text': image.image.name.split('/')[-1] if image.image else 'No name',
                 'image_url': image.image.url if image.image else '',
@@ -904,13 +762,28 @@ def image_api(request):
                     'parent_code': p.parent_code,
                     'child_code': p.child_code
                 } for p in linked_products[:5]]  # Limit to first 5 for performance
-            })
+            }
         
-        # Apply pagination
-        paginated_data = custom_paginate_queryset(
-            queryset=image_data,
+        # Apply pagination (keyset on id when ?cursor= is given)
+        if 'cursor' in request.GET:
+            try:
+                paginated_data = cursor_paginate_queryset(
+                    queryset=images,
+                    sort_field='id',
+                    descending=True,
+                    cursor=request.GET.get('cursor'),
+                    page_size=int(request.GET.get('page_size', 20)),
+                    serialize=serialize
+                )
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            return JsonResponse(paginated_data, safe=False)
+
+        paginated_data = paginate_queryset(
+            queryset=images,
             page=int(request.GET.get('page', 1)),
-            page_size=int(request.GET.get('page_size', 20))
+            page_size=int(request.GET.get('page_size', 20)),
+            serialize=serialize
         )
         
         return JsonResponse(paginated_data, safe=False)
@@ -1122,8 +995,8 @@ def product_images_api(request, product_id):
                     })
             
             # If no images found, return the main product image if available
-            if not image_data and product.images.exists():
-                main_image = product.images.first()
+            main_image = product.primary_image
+            if not image_data and main_image:
                 image_data.append({
                     'url': main_image.image.url,
                     'alt': f'{product.parent_code} - {product.child_code}'
@@ -1150,95 +1023,29 @@ def pairing_set_view(request):
         data = request.POST
         method_type = data.get('method_type')
         if method_type == 'export':
-            # Export pairing sets to Excel
-            pairing_sets = PairingSet.objects.all().order_by('pair_value')
-            
-            # Create workbook and worksheet
-            workbook = Workbook()
-            worksheet = workbook.active
-            worksheet.title = "Pairing Sets"
-            
-            # Add headers
-            headers = ['ID', 'Pair Value']
-            for col_num, header in enumerate(headers, 1):
-                worksheet.cell(row=1, column=col_num, value=header)
-            
-            # Add data
-            for row_num, pairing_set in enumerate(pairing_sets, 2):
-                worksheet.cell(row=row_num, column=1, value=pairing_set.id)
-                worksheet.cell(row=row_num, column=2, value=pairing_set.pair_value)
-            
-            # Create HTTP response with Excel file
-            response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response['Content-Disposition'] = 'attachment; filename=pairing_sets_export.xlsx'
-            workbook.save(response)
-            return response
+            # Downloads are GETs so their ETag revalidation applies; send old form posts there
+            url = reverse('pairing_set_export')
+            if data.get('format'):
+                url += '?' + urlencode({'format': data['format']})
+            return redirect(url)
         elif method_type == 'create':
             # Check if Excel file is uploaded
             if 'excel_file' in request.FILES:
                 excel_file = request.FILES['excel_file']
                 
                 # Validate file extension
-                if not excel_file.name.endswith(('.xlsx', '.xls')):
-                    messages.error(request, 'Please upload a valid Excel file (.xlsx or .xls).')
+                if not excel_file.name.lower().endswith(('.xlsx', '.xls', '.csv')):
+                    messages.error(request, 'Please upload a valid Excel file (.xlsx or .xls) or a CSV file.')
                     return redirect('pairing_set')
                 
                 try:
-                    # Load the Excel file
-                    workbook = load_workbook(excel_file)
-                    sheet = workbook.active
-                    
-                    pair_values = []
-                    # Read values from the first column, starting from row 1
-                    for row in sheet.iter_rows(min_row=1, max_col=1, values_only=True):
-                        if row[0] is not None:
-                            value = str(row[0]).strip()
-                            if value:  # Only add non-empty values
-                                pair_values.append(value)
-                    
-                    if not pair_values:
-                        messages.error(request, 'No valid pairing set values found in the Excel file.')
-                        return redirect('pairing_set')
-                    
-                    # Process the values
-                    created_count = 0
-                    skipped_count = 0
-                    error_values = []
-                    
-                    for single_pair_value in pair_values:
-                        if not single_pair_value:
-                            continue
-                        
-                        # Check if pairing set already exists
-                        if PairingSet.objects.filter(pair_value=single_pair_value).exists():
-                            skipped_count += 1
-                            continue
-                        
-                        try:
-                            PairingSet.objects.create(pair_value=single_pair_value)
-                            created_count += 1
-                        except Exception as e:
-                            error_values.append(f"{single_pair_value}: {str(e)}")
-                    
-                    # Prepare success message
-                    success_msg = f'Excel upload completed: {created_count} pairing set(s) created'
-                    if skipped_count > 0:
-                        success_msg += f', {skipped_count} skipped (already exist)'
-                    
-                    if error_values:
-                        success_msg += f'. Errors: {"; ".join(error_values[:3])}'  # Show first 3 errors
-                        if len(error_values) > 3:
-                            success_msg += f' and {len(error_values) - 3} more errors.'
-                    
-                    if created_count > 0:
-                        messages.success(request, success_msg)
-                    else:
-                        messages.warning(request, success_msg)
-                        
+                    job = enqueue('pairing_set_import', upload=excel_file, user=request.user)
                 except Exception as e:
                     messages.error(request, f'Error processing Excel file: {str(e)}')
-                
-                return redirect('pairing_set')
+                    return redirect('pairing_set')
+
+                messages.info(request, 'File uploaded, importing in the background.')
+                return redirect(f"{reverse('pairing_set')}?job={job.id}")
             else:
                 messages.error(request, 'Please upload an Excel file.')
                 return redirect('pairing_set')
@@ -1265,6 +1072,13 @@ def pairing_set_view(request):
             return redirect('pairing_set')
     return render(request, 'pairing_set.html')
 
+@login_required
+def pairing_set_export(request):
+    """Pairing sets export in the ?format= asked for, cached per catalog version"""
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse({'error': 'Only GET requests are allowed'}, status=405)
+    return cached_export_response(request, 'pairing_sets', 'pairing_sets_export')
+
 @login_required
 def pairing_set_print_view(request):
     """Print view for pairing sets"""
@@ -1537,7 +1351,7 @@ def export_customer_cart_excel(request, customer_id):
     try:
         customer = get_object_or_404(Customer, id=customer_id)
         cart, created = Cart.objects.get_or_create(customer=customer, is_active=True)
-        cart_items = CartItem.objects.filter(cart=cart).select_related('product')
+        cart_items = export_cart_items(cart)
         
         # Create workbook and worksheet
         wb = Workbook()
@@ -1649,13 +1463,13 @@ def export_customer_cart_excel(request, customer_id):
         for ci in cart_items:
             p = ci.product
             if currency == 'USD':
-                unit = to_float(p.usd_rate or 0)
+                unit = float(p.usd_rate_value or 0)
                 label = 'USD'
             elif currency == 'EUR':
-                unit = to_float(p.euro_rate or 0)
+                unit = float(p.euro_rate_value or 0)
                 label = 'EUR'
             else:
-                unit = to_float(p.thai_baht or 0)
+                unit = float(p.thai_baht_value or 0)
                 label = 'THB'
             amount = unit * ci.quantity if unit else 0.0
             total_amount += amount
@@ -1683,12 +1497,12 @@ def export_customer_cart_excel(request, customer_id):
                 'amount': amount,
                 'location': p.location or '-',
                 'kpo': p.kpo or '-',
-                'pairing_set': ', '.join([ps.pair_value for ps in p.pairing_set.all()]) if hasattr(p, 'pairing_set') else '-',
+                'pairing_set': ci.pairing_values or '',
                 'note1': p.note_1 or '-',
                 'note2': p.note_2 or '-',
-                'thb': to_float(p.thai_baht or 0),
-                'usd': to_float(p.usd_rate or 0),
-                'eur': to_float(p.euro_rate or 0),
+                'thb': float(p.thai_baht_value or 0),
+                'usd': float(p.usd_rate_value or 0),
+                'eur': float(p.euro_rate_value or 0),
             })
 
         for it in items_for_export:
@@ -1710,6 +1524,10 @@ def export_customer_cart_excel(request, customer_id):
                 elif c == 'usd': row.append(it['usd'])
                 elif c == 'euro': row.append(it['eur'])
             ws.append(row)
+            # Prices are stored at full precision; cells keep it and display two decimals
+            for col_idx, c in enumerate(selected_cols, start=1):
+                if c in ('price_thb', 'amount_thb', 'thb', 'usd', 'euro'):
+                    ws.cell(row=ws.max_row, column=col_idx).number_format = '#,##0.00'
 
         ws.append([])
         from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
@@ -1801,7 +1619,7 @@ def print_customer_cart(request, customer_id):
     try:
         customer = get_object_or_404(Customer, id=customer_id)
         cart, created = Cart.objects.get_or_create(customer=customer, is_active=True)
-        cart_items = CartItem.objects.filter(cart=cart).select_related('product')
+        cart_items = export_cart_items(cart)
         currency = (request.GET.get('currency') or 'THB').upper()
         if currency not in ('THB', 'USD', 'EUR'):
             currency = 'THB'
@@ -1828,29 +1646,21 @@ def print_customer_cart(request, customer_id):
         for ci in cart_items:
             p = ci.product
             if currency == 'USD':
-                unit = float(p.usd_rate or 0)
+                unit = float(p.usd_rate_value or 0)
                 label = 'USD'
             elif currency == 'EUR':
-                unit = float(p.euro_rate or 0)
+                unit = float(p.euro_rate_value or 0)
                 label = 'EUR'
             else:
-                unit = float(p.thai_baht or 0)
+                unit = float(p.thai_baht_value or 0)
                 label = 'THB'
             amount = unit * ci.quantity if unit else 0.0
             total_amount += amount
             # extra fields for dynamic columns
             try:
-                image_url = ''
-                if p.images.exists():
-                    first_image = p.images.first()
-                    image_url = request.build_absolute_uri(first_image.image.url)
+                image_url = request.build_absolute_uri(p.primary_image.image.url) if p.primary_image else ''
             except Exception:
                 image_url = ''
-            pairing_values = []
-            try:
-                pairing_values = [ps.pair_value for ps in p.pairing_set.all()]
-            except Exception:
-                pairing_values = []
             items_for_print.append({
                 'code': f"{p.child_code}",
                 'name': p.tag.name if p.tag else '-',
@@ -1864,10 +1674,10 @@ def print_customer_cart(request, customer_id):
                 'kpo': p.kpo or '-',
                 'note1': p.note_1 or '-',
                 'note2': p.note_2 or '-',
-                'pairing_set': ", ".join(pairing_values) if pairing_values else '-',
-                'thb': to_float(p.thai_baht or 0),
-                'usd': to_float(p.usd_rate or 0),
-                'eur': to_float(p.euro_rate or 0),
+                'pairing_set': ci.pairing_values or '-',
+                'thb': float(p.thai_baht_value or 0),
+                'usd': float(p.usd_rate_value or 0),
+                'eur': float(p.euro_rate_value or 0),
             })
 
         # Calculate totals and annotate items with computed fields
@@ -1877,10 +1687,7 @@ def print_customer_cart(request, customer_id):
             for item in cart_items
         )
         for item in cart_items:
-            try:
-                item.amount_thb = to_float(item.product.thai_baht) * item.quantity
-            except Exception:
-                item.amount_thb = 0.0
+            item.amount_thb = float(item.product.thai_baht_value or 0) * item.quantity
         shipping = float(cart.shipping_amount or 0)
         deposit = float(cart.deposit_amount or 0)
         grand_total = total_amount + shipping - deposit
@@ -1972,79 +1779,61 @@ def import_customer_cart_excel(request, customer_id):
         if not file:
             return JsonResponse({'success': False, 'message': 'No file uploaded'})
         try:
-            wb = load_workbook(filename=file, data_only=True)
-            ws = wb.active
-
-            # Detect header row and indices for code/quantity
-            start_row = 1
-            idx_code = 0
-            idx_qty = 1
-            first_row_values = [cell.value for cell in ws[1]] if ws.max_row >= 1 else []
-            if first_row_values:
-                header_lower = [str(v).strip().lower() if v is not None else '' for v in first_row_values]
-                def find_index(options, default=None):
-                    for opt in options:
-                        if opt in header_lower:
-                            return header_lower.index(opt)
-                    return default
-                code_idx = find_index(['product code', 'code'])
-                qty_idx = find_index(['quantity', 'qty'])
-                headers_present = (code_idx is not None) or (qty_idx is not None)
-                if code_idx is not None:
-                    idx_code = code_idx
-                if qty_idx is not None:
-                    idx_qty = qty_idx
-                if headers_present:
-                    start_row = 2
+            with TableReader(file) as reader:
+                # The header row is optional; without one, code and quantity are the first two columns
+                records = iter_records(
+                    reader.rows(),
+                    {'code': ['product code', 'code'], 'quantity': ['quantity', 'qty']},
+                    header='auto',
+                    defaults={'code': 0, 'quantity': 1},
+                )
 
-            cart, _ = Cart.objects.get_or_create(customer=customer, is_active=True)
-            added = updated = ignored = processed = 0
-
-            for row in ws.iter_rows(min_row=start_row, values_only=True):
-                if not row:
-                    continue
-                code_cell = row[idx_code] if len(row) > idx_code else None
-                qty_cell = row[idx_qty] if len(row) > idx_qty else 1
-                if code_cell is None:
-                    ignored += 1
-                    continue
-                code_str = str(code_cell).strip()
-                try:
-                    # Allow numeric cells like 2.0
-                    qty = int(float(qty_cell)) if qty_cell is not None else 1
-                except Exception:
-                    qty = 1
-                if not code_str or qty <= 0:
-                    ignored += 1
-                    continue
-
-                # Find product by combined code or parent/child code
-                product = None
-                if '-' in code_str:
-                    # Split on the LAST hyphen because parent_code may itself contain hyphens
+                cart, _ = Cart.objects.get_or_create(customer=customer, is_active=True)
+                added = updated = ignored = processed = 0
+
+                for record in records:
+                    code_cell = record['code']
+                    qty_cell = record['quantity']
+                    if code_cell is None:
+                        ignored += 1
+                        continue
+                    code_str = str(code_cell).strip()
                     try:
-                        parent, child = code_str.rsplit('-', 1)
-                        product = Product.objects.filter(parent_code=parent.strip(), child_code=child.strip()).first()
-                    except ValueError:
-                        product = None
-                if not product:
-                    product = Product.objects.filter(Q(child_code=code_str) | Q(parent_code=code_str)).first()
-                if not product:
-                    ignored += 1
-                    continue
+                        # Allow numeric cells like 2.0
+                        qty = int(float(qty_cell)) if qty_cell is not None else 1
+                    except Exception:
+                        qty = 1
+                    if not code_str or qty <= 0:
+                        ignored += 1
+                        continue
 
-                cart_item, created = CartItem.objects.get_or_create(
-                    cart=cart,
-                    product=product,
-                    defaults={'quantity': qty}
-                )
-                if created:
-                    added += 1
-                else:
-                    cart_item.quantity += qty
-                    cart_item.save()
-                    updated += 1
-                processed += 1
+                    # Find product by combined code or parent/child code
+                    product = None
+                    if '-' in code_str:
+                        # Split on the LAST hyphen because parent_code may itself contain hyphens
+                        try:
+                            parent, child = code_str.rsplit('-', 1)
+                            product = Product.objects.filter(parent_code=parent.strip(), child_code=child.strip()).first()
+                        except ValueError:
+                            product = None
+                    if not product:
+                        product = Product.objects.filter(Q(child_code=code_str) | Q(parent_code=code_str)).first()
+                    if not product:
+                        ignored += 1
+                        continue
+
+                    cart_item, created = CartItem.objects.get_or_create(
+                        cart=cart,
+                        product=product,
+                        defaults={'quantity': qty}
+                    )
+                    if created:
+                        added += 1
+                    else:
+                        cart_item.quantity += qty
+                        cart_item.save()
+                        updated += 1
+                    processed += 1
 
             return JsonResponse({
                 'success': True,
@@ -2183,24 +1972,24 @@ def cart_api(request, customer_id):
             currency_note = None
             try:
                 if currency == 'THB':
-                    price_val = Decimal(str(product.thai_baht or 0))
+                    price_val = product.thai_baht_value or Decimal(0)
                     currency_note = 'THB'
                 elif currency == 'USD':
-                    price_val = Decimal(str(product.usd_rate or 0))
+                    price_val = product.usd_rate_value or Decimal(0)
                     currency_note = 'USD'
                 elif currency == 'EUR':
-                    price_val = Decimal(str(product.euro_rate or 0))
+                    price_val = product.euro_rate_value or Decimal(0)
                     currency_note = 'EUR'
                 else:
                     # auto preferred fallback
-                    if product.thai_baht:
-                        price_val = Decimal(str(product.thai_baht))
+                    if product.thai_baht_value is not None:
+                        price_val = product.thai_baht_value
                         currency_note = 'THB'
-                    elif product.usd_rate:
-                        price_val = Decimal(str(product.usd_rate))
+                    elif product.usd_rate_value is not None:
+                        price_val = product.usd_rate_value
                         currency_note = 'USD'
-                    elif product.euro_rate:
-                        price_val = Decimal(str(product.euro_rate))
+                    elif product.euro_rate_value is not None:
+                        price_val = product.euro_rate_value
                         currency_note = 'EUR'
             except Exception:
                 price_val = None
@@ -2209,7 +1998,7 @@ def cart_api(request, customer_id):
             amount_val = None
             if price_val is not None:
                 try:
-                    amount_val = price_val * Decimal(str(item.quantity))
+                    amount_val = price_val * item.quantity
                 except Exception:
                     amount_val = None
 
@@ -2321,6 +2110,7 @@ def add_to_cart_api(request):
 
 
 @csrf_exempt
+@condition(etag_func=versioned_etag(CUSTOMERS, CARTS))
 def customers_android_api(request):
     """API endpoint for Android app to get customer data without authentication"""
     if request.method == 'GET':
@@ -2441,6 +2231,7 @@ def add_to_cart_bulk_android(request):
 
 
 @csrf_exempt
+@condition(etag_func=versioned_etag(CARTS, CATALOG))
 def cart_android_api(request, customer_id):
     """API endpoint for Android app to get and modify customer cart data without authentication"""
     try:
@@ -2451,15 +2242,14 @@ def cart_android_api(request, customer_id):
 
         if request.method == 'GET':
             cart_items = []
-            for item in cart.items.all():
-                image_url = ''
-                if item.product.images.exists():
-                    first_image = item.product.images.first()
-                    image_url = request.build_absolute_uri(first_image.image.url)
+            cart_item_qs = cart.items.select_related('product__tag', 'product__primary_image').prefetch_related('product__pairing_set')
+            for item in cart_item_qs:
+                primary_image = item.product.primary_image
+                image_url = request.build_absolute_uri(primary_image.image.url) if primary_image else ''
 
                 product_full = {
                     'id': item.product.id,
-                    'image': item.product.images.first().image.url if item.product.images.exists() else '',
+                    'image': primary_image.image.url if primary_image else '',
                     'parent_code': item.product.parent_code,
                     'child_code': item.product.child_code,
                     'location': item.product.location,
@@ -2473,7 +2263,7 @@ def cart_android_api(request, customer_id):
                     'note_2': item.product.note_2,
                     'tag': item.product.tag.name if item.product.tag else '',
                     'pairing_set': [ps.id for ps in item.product.pairing_set.all()],
-                    'image_count': item.product.images.count(),
+                    'image_count': item.product.image_count,
                 }
 
                 cart_items.append({
@@ -2482,7 +2272,7 @@ def cart_android_api(request, customer_id):
                     'product_code': f"{item.product.child_code}",
                     'product_name': f"{item.product.child_code}",
                     'product_location': item.product.location or '',
-                    'price': float(item.product.thai_baht) if item.product.thai_baht else 0.0,
+                    'price': float(item.product.thai_baht_value or 0),
                     'image_url': image_url,
                     'quantity': item.quantity,
                     'added_at': item.added_at.strftime('%Y-%m-%d %H:%M:%S'),
@@ -2599,7 +2389,7 @@ def cart_android_api(request, customer_id):
 def customers_android_locked_count_api(request):
     if request.method != 'GET':
         return JsonResponse({'error': 'Only GET method allowed'}, status=405)
-    count = Customer.objects.filter(locked=True).count()
+    count = cache.get_or_set(make_key(CUSTOMERS, 'locked_count'), lambda: Customer.objects.filter(locked=True).count())
     return JsonResponse({'locked_count': count})
 
 
@@ -2607,5 +2397,8 @@ def customers_android_locked_count_api(request):
 def customers_android_locked_ids_api(request):
     if request.method != 'GET':
         return JsonResponse({'error': 'Only GET method allowed'}, status=405)
-    ids = list(Customer.objects.filter(locked=True).values_list('id', flat=True))
+    ids = cache.get_or_set(
+        make_key(CUSTOMERS, 'locked_ids'),
+        lambda: list(Customer.objects.filter(locked=True).values_list('id', flat=True))
+    )
     return JsonResponse({'locked_ids': ids})
@@ -144,17 +144,43 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 #media_path
 MEDIA_ROOT =  os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+# Prebuilt catalog snapshots for offline scanner bootstrap (manage.py build_catalog_snapshot)
+CATALOG_SNAPSHOT_DIR = os.getenv('CATALOG_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'snapshots'))
+# Export files reused until the catalog changes
+EXPORT_CACHE_DIR = os.getenv('EXPORT_CACHE_DIR', os.path.join(BASE_DIR, 'export_cache'))
+# Uploads, exports and snapshot builds are queued as background jobs and only run while a
+# `manage.py run_jobs` worker is up. Set BACKGROUND_JOBS_INLINE=1 to run them inside the
+# request instead, e.g. in development without a worker.
+BACKGROUND_JOBS_INLINE = os.getenv('BACKGROUND_JOBS_INLINE', 'False').lower() in ('true', '1', 'yes')
 LOGIN_URL='login'
 LOGIN_REDIRECT_URL='login'
 
 CSRF_TRUSTED_ORIGINS = ['https://karen.tech-vikings.com']
 
+# Cache backend, selected with CACHE_BACKEND: 'locmem' (per process), 'file', 'database'
+# or 'redis'. Version counters live in the database, so every gunicorn worker sees a bump;
+# cached pages are only shared between workers with one of the shared backends, with
+# 'locmem' each worker fills its own. 'database' needs `manage.py createcachetable`,
+# 'redis' needs the redis package.
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'unique-snowflake'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', '/var/tmp/karen_cache'),
+    'database': ('django.core.cache.backends.db.DatabaseCache', 'karen_cache'),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+}
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem').lower()
+cache_backend, cache_location = CACHE_BACKENDS[CACHE_BACKEND]
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': cache_backend,
+        'LOCATION': os.getenv('CACHE_LOCATION', cache_location),
+        'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', 'karen'),
     }
 }
+if CACHE_BACKEND != 'redis':
+    # Django's default of 300 entries is far below the number of cached catalog pages
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '20000'))}
 
 # CORS settings for mobile app
 CORS_ALLOW_ALL_ORIGINS = True